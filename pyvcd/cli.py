@@ -0,0 +1,421 @@
+import argparse
+from collections import deque
+import csv
+import getpass
+import json
+import os
+from Queue import Queue
+import sys
+import threading
+import time
+
+from lxml import objectify
+
+from client import VCloudClient
+from edge_gateway import EdgeGatewayDriver
+
+
+FIREWALL_RULE = 'firewall_rule'
+POOL = 'pool'
+VIRTUAL_SERVER = 'virtual_server'
+
+FIREWALL_RULE_FIELDS = (
+    'name', 'protocol', 'src_ip_range', 'dest_port_range', 'dest_ip_range',
+    'src_port', 'src_port_range', 'dest_port', 'policy',
+)
+
+
+def _write_error(message):
+    sys.stderr.write(message + '\n')
+
+
+def read_records(stream, record_format='jsonl', on_error=None):
+    """
+    Yield record dicts from a CSV or JSON lines stream one at a time. Empty
+    CSV cells and blank lines are skipped. Lines that aren't a JSON object
+    are reported and skipped.
+
+    :param stream: File-like object.
+    :param record_format: One of 'csv' or 'jsonl'. Default 'jsonl'.
+    :param on_error: Callable taking a message for each skipped line.
+    Default writes to stderr.
+    :return: Generator of record dicts.
+    """
+    on_error = on_error or _write_error
+
+    if record_format == 'csv':
+        for row in csv.DictReader(stream):
+            yield dict((key, value) for key, value in row.items() if value)
+    else:
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+
+            if isinstance(record, dict):
+                yield record
+            else:
+                on_error('{}:{}: malformed record'.format(
+                    getattr(stream, 'name', '<records>'), number))
+
+
+def _specs(value):
+    if isinstance(value, basestring):
+        return [spec for spec in value.split(';') if spec]
+    return list(value or [])
+
+
+def _service_port(spec):
+    """
+    Build a pool ServicePort from 'protocol:port[:algorithm]'.
+    """
+    parts = spec.split(':')
+    service_port = objectify.Element('ServicePort')
+    service_port.IsEnabled = 'true'
+    service_port.Protocol = parts[0].upper()
+    service_port.Algorithm = parts[2] if len(parts) > 2 else 'ROUND_ROBIN'
+    service_port.Port = parts[1]
+    service_port.HealthCheckPort = parts[1]
+    return service_port
+
+
+def _member(spec, service_ports):
+    """
+    Build a pool Member from 'ip[:port[:weight]]'. The member gets a
+    ServicePort for each pool service port.
+    """
+    parts = spec.split(':')
+    member = objectify.Element('Member')
+    member.IpAddress = parts[0]
+    member.Weight = parts[2] if len(parts) > 2 else 1
+
+    for pool_service_port in service_ports:
+        port = parts[1] if len(parts) > 1 and parts[1] else \
+            pool_service_port.Port.text
+        service_port = objectify.Element('ServicePort')
+        service_port.Protocol = pool_service_port.Protocol.text
+        service_port.Port = port
+        service_port.HealthCheckPort = port
+        member.append(service_port)
+
+    return member
+
+
+def _service_profile(spec):
+    """
+    Build a virtual server ServiceProfile from 'protocol:port'.
+    """
+    protocol, port = spec.split(':')
+    service_profile = objectify.Element('ServiceProfile')
+    service_profile.IsEnabled = 'true'
+    service_profile.Protocol = protocol.upper()
+    service_profile.Port = port
+    return service_profile
+
+
+def stage(driver, record):
+    """
+    Stage a record on a loaded EdgeGatewayDriver.
+
+    :param driver: EdgeGatewayDriver.
+    :param record: Record dict with a 'kind' of 'firewall_rule', 'pool' or
+    'virtual_server'.
+    """
+    kind = record.get('kind')
+
+    if kind == FIREWALL_RULE:
+        driver.add_firewall_rule(**dict(
+            (field, record[field])
+            for field in FIREWALL_RULE_FIELDS if field in record))
+    elif kind == POOL:
+        service_ports = [
+            _service_port(spec) for spec in _specs(record['service_ports'])]
+        members = [
+            _member(spec, service_ports) for spec in _specs(record['members'])]
+        driver.add_pool(
+            record['name'], service_ports, members,
+            record.get('description', ''))
+    elif kind == VIRTUAL_SERVER:
+        driver.add_virtual_server(
+            record['name'], record['ip_address'], record['pool_name'],
+            record['network_name'],
+            [_service_profile(spec)
+             for spec in _specs(record['service_profiles'])],
+            record.get('description', ''))
+    else:
+        raise ValueError('Unknown record kind.', kind)
+
+
+class GatewayStats(object):
+    """
+    Progress of the batches committed to one edge gateway.
+    """
+    def __init__(self):
+        self.items = 0
+        self.batches = 0
+        self.failures = 0
+        self.first_latency = None
+        self.last_latency = None
+
+
+class BulkApplier(object):
+    """
+    Use the BulkApplier to stage records on their edge gateways and commit
+    them in batches. Batches of one gateway are committed in order by one
+    worker at a time, while up to `parallel` gateways are committed
+    concurrently. Requires a VCloudClient object that has already been
+    authenticated.
+    """
+    def __init__(self, client, parallel=4, batch_size=100, out=sys.stderr):
+        if parallel < 1:
+            raise ValueError('parallel must be at least 1.', parallel)
+
+        self._client = client
+        self.parallel = parallel
+        self.batch_size = batch_size
+        self.out = out
+        self.stats = {}
+        self.skipped = 0
+        self._drivers = {}
+        self._batches = {}
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        self._ready = Queue()
+        self._outstanding = threading.BoundedSemaphore(parallel * 2)
+        self._started = None
+
+    def apply(self, records):
+        """
+        Stage and commit all records. Records are read as they are needed.
+        At most one partial batch is held per gateway seen so far, and at
+        most twice `parallel` full batches wait to be committed, so memory
+        use grows with the number of gateways times the batch size rather
+        than with the number of records. Records without a gateway are
+        reported and skipped. If reading the records raises, the batches
+        already submitted are committed before the error is raised.
+
+        :param records: Iterable of record dicts with a 'gateway' key.
+        :return: Dict of gateway name to GatewayStats.
+        """
+        self._started = time.time()
+        threads = []
+        for _ in xrange(self.parallel):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            pending = {}
+            for record in records:
+                gateway = record.get('gateway')
+                if not gateway:
+                    self.skip('record without gateway: {!r}'.format(record))
+                    continue
+
+                batch = pending.setdefault(gateway, [])
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self._submit(gateway, pending.pop(gateway))
+
+            for gateway, batch in pending.items():
+                self._submit(gateway, batch)
+        finally:
+            for _ in threads:
+                self._ready.put(None)
+            for thread in threads:
+                thread.join()
+
+        return self.stats
+
+    def skip(self, message):
+        """
+        Report a record that is skipped.
+
+        :param message: Description of the record.
+        """
+        with self._lock:
+            self.skipped += 1
+        self._report('skipped {}'.format(message))
+
+    def _submit(self, gateway, batch):
+        self._outstanding.acquire()
+        with self._lock:
+            self._batches.setdefault(gateway, deque()).append(batch)
+            if gateway in self._scheduled:
+                return
+            self._scheduled.add(gateway)
+        self._ready.put(gateway)
+
+    def _work(self):
+        while True:
+            gateway = self._ready.get()
+            if gateway is None:
+                return
+
+            while True:
+                with self._lock:
+                    if not self._batches[gateway]:
+                        self._scheduled.discard(gateway)
+                        break
+                    batch = self._batches[gateway].popleft()
+
+                try:
+                    self._commit(gateway, batch)
+                finally:
+                    self._outstanding.release()
+
+    def _commit(self, gateway, batch):
+        stats = self.stats.setdefault(gateway, GatewayStats())
+        started = time.time()
+
+        try:
+            driver = self._drivers.get(gateway)
+            if driver is None:
+                driver = EdgeGatewayDriver(self._client, gateway)
+                driver.load()
+
+            # A record that can't be staged is skipped, the rest of the
+            # batch is still committed.
+            staged = 0
+            for record in batch:
+                try:
+                    stage(driver, record)
+                except Exception as e:
+                    self.skip('record {!r}: {!r}'.format(record, e))
+                    continue
+                staged += 1
+
+            if not staged:
+                self._drivers[gateway] = driver
+                return
+
+            driver.commit()
+            self._drivers[gateway] = driver
+        except Exception as e:
+            # The staged configuration is unknown now, reload next batch.
+            self._drivers.pop(gateway, None)
+            stats.failures += 1
+            self._report('{}: batch failed: {!r}'.format(gateway, e))
+            return
+
+        latency = time.time() - started
+        with self._lock:
+            stats.items += staged
+            stats.batches += 1
+            if stats.first_latency is None:
+                stats.first_latency = latency
+            stats.last_latency = latency
+            total = sum(item.items for item in self.stats.values())
+
+        self._report(
+            '{}: committed {} items in {:.2f}s, {} total, {:.1f} items/s'
+            .format(gateway, staged, latency, total,
+                    total / max(time.time() - self._started, 1e-6)))
+
+    def _report(self, message):
+        with self._lock:
+            self.out.write(message + '\n')
+            self.out.flush()
+
+    def summary(self):
+        """
+        Write the first and last commit latency of each gateway.
+        """
+        for gateway, stats in sorted(self.stats.items()):
+            if stats.batches:
+                self._report(
+                    '{}: {} items in {} batches, first latency {:.2f}s, '
+                    'last latency {:.2f}s, {} failed batches'.format(
+                        gateway, stats.items, stats.batches,
+                        stats.first_latency, stats.last_latency,
+                        stats.failures))
+            else:
+                self._report('{}: {} failed batches'.format(
+                    gateway, stats.failures))
+
+        if self.skipped:
+            self._report('{} skipped records'.format(self.skipped))
+
+
+def _open_inputs(paths, record_format, on_error=None):
+    for path in paths:
+        if path == '-':
+            for record in read_records(
+                    sys.stdin, record_format or 'jsonl', on_error):
+                yield record
+            continue
+
+        if record_format:
+            path_format = record_format
+        elif path.endswith('.csv'):
+            path_format = 'csv'
+        else:
+            path_format = 'jsonl'
+
+        with open(path) as stream:
+            for record in read_records(stream, path_format, on_error):
+                yield record
+
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            'must be at least 1: {}'.format(value))
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pyvcd',
+        description='Stage and commit edge gateway firewall rules, pools '
+                    'and virtual servers from CSV or JSON lines records.')
+    parser.add_argument(
+        'paths', nargs='*', default=['-'], metavar='PATH',
+        help='Record files, or - for stdin. Default stdin.')
+    parser.add_argument('--host', required=True)
+    parser.add_argument('--org', required=True)
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--api-version', default='5.1')
+    parser.add_argument(
+        '--format', choices=('csv', 'jsonl'), dest='record_format',
+        help='Record format. Default by file extension, jsonl for stdin.')
+    parser.add_argument(
+        '--parallel', type=_positive_int, default=4,
+        help='Number of gateways committed concurrently. Default 4.')
+    parser.add_argument(
+        '--batch-size', type=_positive_int, default=100,
+        help='Maximum records per gateway commit. Default 100.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Entry point of the pyvcd console script. The password is read from the
+    PYVCD_PASSWORD environment variable or prompted for.
+    """
+    args = parse_args(argv)
+
+    password = os.environ.get('PYVCD_PASSWORD') or getpass.getpass()
+    client = VCloudClient(args.host, args.api_version, args.org)
+    client.authenticate(args.user, password)
+
+    applier = BulkApplier(client, args.parallel, args.batch_size)
+    stats = applier.apply(
+        _open_inputs(args.paths, args.record_format, applier.skip))
+    applier.summary()
+
+    if applier.skipped or any(item.failures for item in stats.values()):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,47 +1,77 @@
-from copy import copy
+from functools import partial
+import threading
 from time import sleep
 
 from lxml import objectify
-import requests
 
 import errors
+from transport import RequestsTransport
+
+
+CHUNK_SIZE = 64 * 1024
 
 
 class VCloudClient(object):
     """
-    Simple client for making requests to the VCD API.
+    Simple client for making requests to the VCD API. Requests are sent
+    through the transport, by default a RequestsTransport.
+
+    One client can be shared by many threads. Headers are built once per
+    auth token and never modified, and when the auth token expires the first
+    thread to notice logs in again while the others wait for the new token.
     """
-    def __init__(self, host, version, org):
+    def __init__(self, host, version, org, transport=None):
+        self.transport = transport or RequestsTransport()
         self.host = host
         self.version = version
         self.org = org
         self.default_headers = {
             'Accept': 'application/*+xml;version=' + version
         }
-        self.auth_token = None
+        self.task_source = None
+        self._auth_lock = threading.Lock()
+        self._credentials = None
+        self._auth = (None, self.default_headers)
+
+    @property
+    def auth_token(self):
+        return self._auth[0]
+
+    @auth_token.setter
+    def auth_token(self, token):
+        headers = dict(self.default_headers)
+        headers['x-vcloud-authorization'] = token
+        self._auth = (token, headers)
 
     def request(self, method, url, data=None, headers=None):
         """
-        Return the response of a request to the VCD API at the given url.
+        Return the response of a request to the VCD API at the given url. If
+        the auth token has expired, log in again and retry once, unless the
+        data is a stream that can't be sent twice.
 
         :param method: Request method.
         :param url: Request url.
-        :param data: Request data payload.
+        :param data: Request data payload. Either a string, a generator of
+        strings or a file-like object. Generators and file-like objects are
+        sent with chunked transfer encoding.
         :param headers: Request headers. Auth headers are automatically added
         for the current client instance.
         :return: Response object.
         """
-        if not self.auth_token:
+        token = self.auth_token
+        if not token:
             raise errors.VCloudAuthError(
                 'Must call authenticate before making a request.')
 
-        merged_headers = copy(self.default_headers)
-        merged_headers['x-vcloud-authorization'] = self.auth_token
-        if headers:
-            merged_headers.update(headers)
+        if hasattr(data, 'read'):
+            data = iter(partial(data.read, CHUNK_SIZE), '')
 
-        response = requests.request(
-            method, url, headers=merged_headers, data=data)
+        response = self._send(method, url, data, headers)
+
+        if response.status_code == 401 and self._credentials:
+            self._refresh(token)
+            if data is None or isinstance(data, basestring):
+                response = self._send(method, url, data, headers)
 
         if response.status_code < 400:
             return response
@@ -49,6 +79,24 @@ class VCloudClient(object):
             raise errors.VCloudAPIError(
                 'VCloud API request failure.', url, response.content)
 
+    def _send(self, method, url, data, headers):
+        merged_headers = self._auth[1]
+        if headers:
+            merged_headers = dict(merged_headers)
+            merged_headers.update(headers)
+
+        return self.transport.request(
+            method, url, headers=merged_headers, data=data)
+
+    def _refresh(self, expired_token):
+        """
+        Log in again unless another thread already replaced the expired
+        token.
+        """
+        with self._auth_lock:
+            if self.auth_token == expired_token:
+                self._login(*self._credentials)
+
     def url(self, path):
         """
         Return the fully qualified url for a VCD API resource.
@@ -59,13 +107,19 @@ class VCloudClient(object):
 
     def authenticate(self, username, password):
         """
-        Authenticate the client to the VCD API server.
+        Authenticate the client to the VCD API server. The credentials are
+        kept to log in again when the auth token expires.
 
         :param username:
         :param password:
         """
+        with self._auth_lock:
+            self._login(username, password)
+            self._credentials = (username, password)
+
+    def _login(self, username, password):
         username = '{}@{}'.format(username, self.org)
-        response = requests.request(
+        response = self.transport.request(
             'post',
             self.url('sessions'),
             headers=self.default_headers,
@@ -81,12 +135,25 @@ class VCloudClient(object):
 
     def wait_for_task(self, task_url, retries=10, retry_delay=15):
         """
-        Poll a VCD API task until it is complete.
+        Poll a VCD API task until it is complete. If a task source such as a
+        NotificationTaskSource is set, wait for its completion event first
+        and only poll if none arrives before the source deadline.
 
         :param task_url: Url of the task.
         :param retries: Number of retry attempts.
         :param retry_delay: Delay between retry attempts in seconds.
         """
+        if self.task_source is not None:
+            status = self.task_source.wait(task_url)
+            if status == 'success':
+                return
+            elif status is not None:
+                raise errors.VCloudAPIError(
+                    'Task did not complete successfully.',
+                    task_url,
+                    None,
+                    status)
+
         for _ in xrange(retries):
             response = self.request('GET', task_url)
             if response.status_code < 400:
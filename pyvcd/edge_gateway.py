@@ -3,7 +3,93 @@ import re
 from lxml import etree, objectify
 
 import errors
+from intervals import ConflictIndex
 from network import NetworkDriver
+from validation import Validator
+
+
+def find_edge_gateway_href(content, name):
+    """
+    Return the href of an edge gateway from an edgeGateway query result.
+
+    :param content: Query result xml document.
+    :param name: Name of the edge gateway.
+    :return: Edge gateway href, or None if not found.
+    """
+    records = objectify.fromstring(content)
+
+    for record in getattr(records, 'EdgeGatewayRecord', []):
+        if record.get('name') == name:
+            return record.get('href')
+
+
+def strip_namespaces(xml):
+    """
+    Return an xml string with the namespace prefixes and declarations left
+    by lxml.objectify removed.
+
+    :param xml: Xml string.
+    :return: Xml string.
+    """
+    xml = re.sub(r'ns\d:', '', xml)
+    xml = re.sub(r'\sxmlns:ns\d=".*"', '', xml)
+    xml = re.sub(r'\sxmlns:xsi=".*"', '', xml)
+
+    return xml
+
+
+def _enabled_protocols(pool):
+    """
+    Return the protocols of the enabled service ports of a pool.
+    """
+    if not hasattr(pool, 'ServicePort'):
+        return set()
+
+    return set(
+        service_port.Protocol.text for service_port in pool.ServicePort
+        if hasattr(service_port, 'Protocol') and
+        str(getattr(service_port, 'IsEnabled', 'true')).lower() != 'false')
+
+
+def _member_key(member, protocols=None):
+    """
+    Return the (ip, port) key of a pool member. The port is the first
+    non-empty port of a member service port with one of the protocols, or of
+    any member service port if no protocols are given, or None.
+    """
+    port = None
+    if hasattr(member, 'ServicePort'):
+        for service_port in member.ServicePort:
+            protocol = getattr(service_port, 'Protocol', None)
+            if protocols and \
+                    (protocol is None or protocol.text not in protocols):
+                continue
+            service_port_port = getattr(service_port, 'Port', None)
+            if service_port_port is not None and service_port_port.text:
+                port = service_port_port.text
+                break
+
+    return member.IpAddress.text, port
+
+
+def _localname(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+class _ChunkWriter(object):
+    """
+    File-like target for etree.xmlfile that collects written chunks.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def drain(self):
+        data = ''.join(self._chunks)
+        del self._chunks[:]
+        return data
 
 
 class EdgeGatewayDriver(object):
@@ -16,6 +102,10 @@ class EdgeGatewayDriver(object):
         self.name = name
         self.edge_gateway = None
         self.config = None
+        self._conflict_index = None
+        self._pool_members = {}
+        self._staged = []
+        self._changed_services = set()
 
     def load(self):
         """
@@ -24,13 +114,9 @@ class EdgeGatewayDriver(object):
         """
         response = self._client.request(
             'GET', self._client.url('query?type=edgeGateway'))
-        records = objectify.fromstring(response.content)
+        url = find_edge_gateway_href(response.content, self.name)
 
-        for record in records.EdgeGatewayRecord:
-            if record.get('name') == self.name:
-                url = record.get('href')
-                break
-        else:
+        if url is None:
             raise errors.VCloudNotFoundError(
                 'Edge gateway not found.', self.name)
 
@@ -39,6 +125,23 @@ class EdgeGatewayDriver(object):
         self.edge_gateway = objectify.fromstring(response.content)
         self.config = \
             self.edge_gateway.Configuration.EdgeGatewayServiceConfiguration
+        self._conflict_index = None
+        self._pool_members = {}
+        self._staged = []
+        self._changed_services = set()
+
+    def conflict_index(self):
+        """
+        Return the conflict index of the current edge gateway configuration.
+        The index is built on first use and kept up to date by the add_*
+        methods.
+
+        :return: ConflictIndex of the firewall rules and virtual servers.
+        """
+        if self._conflict_index is None:
+            self._conflict_index = ConflictIndex(self.config)
+
+        return self._conflict_index
 
     def add_service(self, service_name):
         """
@@ -63,7 +166,8 @@ class EdgeGatewayDriver(object):
     def add_firewall_rule(
             self, name, protocol,
             src_ip_range, dest_port_range, dest_ip_range,
-            src_port=-1, src_port_range='Any', dest_port=None, policy='allow'):
+            src_port=-1, src_port_range='Any', dest_port=None, policy='allow',
+            check_overlap=False):
         """
         Add a firewall rule to the current edge gateway firewall service. Adds
         the firewall service to the edge gateway if it doesn't exist.
@@ -84,6 +188,10 @@ class EdgeGatewayDriver(object):
         :param dest_port: Destination port or port range. Default None, sets
         dest_port equal to dest_port_range.
         :param policy: Rule policy, one of 'Allow' or 'Deny'. Default 'Allow'.
+        :param check_overlap: Raise if the rule overlaps the source IPs,
+        destination IPs, destination ports and protocol of an existing rule.
+        Raises VCloudValidationError if the ranges can't be parsed. Default
+        False.
         """
         if not dest_port:
             dest_port = dest_port_range
@@ -111,7 +219,27 @@ class EdgeGatewayDriver(object):
                     raise errors.VCloudResourceConflict(
                         'Firewall rule already exists.', name)
 
+        if check_overlap:
+            try:
+                overlapping = self.conflict_index().overlapping_firewall_rules(
+                    src_ip_range, dest_ip_range, dest_port_range, protocol)
+            except ValueError as e:
+                raise errors.VCloudValidationError(
+                    'Invalid firewall rule.',
+                    ['Firewall rule {!r}: {} {!r}'.format(name, *e.args)])
+
+            for existing_rule in overlapping:
+                raise errors.VCloudResourceConflict(
+                    'Firewall rule overlaps an existing rule.',
+                    name,
+                    existing_rule.Description)
+
         firewall_service.append(rule)
+        self._staged.append(rule)
+        self._changed_services.add('FirewallService')
+
+        if self._conflict_index is not None:
+            self._conflict_index.add_firewall_rule(rule)
 
     def add_pool(self, name, service_ports, members, description=''):
         """
@@ -149,10 +277,169 @@ class EdgeGatewayDriver(object):
                         'Pool already exists.', name)
 
         load_balancer_service.append(pool)
+        self._staged.append(pool)
+        self._changed_services.add('LoadBalancerService')
+
+    def _pool_member_index(self, name):
+        """
+        Return the pool element, its members indexed by ip and port and the
+        protocols of its enabled service ports, building the index on first
+        use. Members that share an ip and port are kept together under one
+        key.
+        """
+        if name in self._pool_members:
+            return self._pool_members[name]
+
+        load_balancer_service = getattr(
+            self.config, 'LoadBalancerService', None)
+        if load_balancer_service is not None and \
+                hasattr(load_balancer_service, 'Pool'):
+            for pool in load_balancer_service.Pool:
+                if pool.Name == name:
+                    break
+            else:
+                pool = None
+        else:
+            pool = None
+
+        if pool is None:
+            raise errors.VCloudNotFoundError('Pool not found.', name)
+
+        protocols = _enabled_protocols(pool)
+        members = {}
+        if hasattr(pool, 'Member'):
+            for member in pool.Member:
+                ip, port = _member_key(member, protocols)
+                members.setdefault(ip, {}).setdefault(port, []).append(member)
+
+        self._pool_members[name] = (pool, members, protocols)
+        return self._pool_members[name]
+
+    @staticmethod
+    def _find_members(name, members, key):
+        if isinstance(key, tuple):
+            ip, port = key[0], str(key[1])
+            if port not in members.get(ip, {}):
+                raise errors.VCloudNotFoundError(
+                    'Pool member not found.', name, ip, port)
+            return [(ip, port)]
+
+        if not members.get(key):
+            raise errors.VCloudNotFoundError(
+                'Pool member not found.', name, key)
+        return [(key, port) for port in members[key]]
+
+    def update_pool_members(self, name, add=None, remove=None, weights=None):
+        """
+        Add, remove and reweight members of an existing pool of the current
+        edge gateway load balancer service. Members are found through an
+        index of the pool by ip and port instead of rebuilding the pool.
+
+        This only stages the update. Call the commit method to perform
+        the update, with changed_only to send only the load balancer service.
+
+        :param name: Name of the pool.
+        :param add: List of lxml ObjectifiedElements representing the
+        members to add.
+        :param remove: List of members to remove, as an ip to remove every
+        member with that ip or an (ip, port) tuple. The port of a member is
+        its port for the first enabled protocol of the pool.
+        :param weights: Dict of members to new weights, with members as in
+        remove.
+        """
+        self._apply_pool_members(
+            self._plan_pool_members(name, add, remove, weights))
+
+    def _plan_pool_members(self, name, add=None, remove=None, weights=None):
+        """
+        Find the members to remove and reweight and check the members to add
+        without changing the pool. Raises if any member is missing or
+        conflicts.
+        """
+        pool, members, protocols = self._pool_member_index(name)
+
+        removed = [
+            member_key for key in remove or []
+            for member_key in self._find_members(name, members, key)]
+        reweighted = [
+            (member_key, weight) for key, weight in (weights or {}).items()
+            for member_key in self._find_members(name, members, key)]
+
+        added = []
+        for member in add or []:
+            ip, port = key = _member_key(member, protocols)
+            if key in [added_key for added_key, _ in added] or \
+                    port in members.get(ip, {}) and key not in removed:
+                raise errors.VCloudResourceConflict(
+                    'Pool member already exists.', name, ip, port)
+            added.append((key, member))
+
+        return pool, members, removed, reweighted, added
+
+    def _apply_pool_members(self, plan):
+        """
+        Apply a plan of _plan_pool_members to its pool.
+        """
+        pool, members, removed, reweighted, add = plan
+
+        for ip, port in removed:
+            if port not in members.get(ip, {}):
+                continue
+            removed_members = members[ip].pop(port)
+            for member in removed_members:
+                pool.remove(member)
+            self._staged = [
+                element for element in self._staged
+                if not any(element is member for member in removed_members)]
+            if not members[ip]:
+                del members[ip]
+
+        for (ip, port), weight in reweighted:
+            for member in members.get(ip, {}).get(port, []):
+                member.Weight = weight
+                # Keep Weight right after IpAddress if it was missing.
+                member.IpAddress.addnext(member.Weight)
+                self._stage_member(pool, member)
+
+        for (ip, port), member in add:
+            if hasattr(pool, 'Member'):
+                pool.Member[-1].addnext(member)
+            else:
+                pool.append(member)
+            members.setdefault(ip, {})[port] = [member]
+            self._stage_member(pool, member)
+
+        self._changed_services.add('LoadBalancerService')
+
+    def _stage_member(self, pool, member):
+        """
+        Stage a member for validation, unless it or its whole pool is
+        already staged.
+        """
+        for element in self._staged:
+            if element is pool or element is member:
+                return
+        self._staged.append(member)
+
+    def update_pools_members(self, updates):
+        """
+        Apply update_pool_members to many pools. Every pool and member is
+        looked up and checked before any pool is changed, so either every
+        update is applied or none is.
+
+        :param updates: Dict of pool name to a dict of the add, remove and
+        weights arguments of update_pool_members.
+        """
+        plans = [
+            self._plan_pool_members(name, **update)
+            for name, update in updates.items()]
+
+        for plan in plans:
+            self._apply_pool_members(plan)
 
     def add_virtual_server(
             self, name, ip_address, pool_name, network_name, service_profiles,
-            description=''):
+            description='', check_overlap=False):
         """
         Add a virtual server to the current edge gateway load balancer service.
         Adds the load balancer service to the edge gateway if it doesn't exist.
@@ -169,6 +456,9 @@ class EdgeGatewayDriver(object):
         :param network_name: Network name to associate with the virtual server.
         :param service_profiles: List of lxml ObjectifiedElements representing
         the service profiles.
+        :param check_overlap: Also compare IPs by value rather than by string
+        through the conflict index. Raises VCloudValidationError if the IP
+        can't be parsed. Default False.
         """
         virtual_server = objectify.Element('VirtualServer')
         virtual_server.IsEnabled = 'true'
@@ -205,14 +495,74 @@ class EdgeGatewayDriver(object):
                         ip_address,
                         existing_virtual_server.Name)
 
+        if check_overlap:
+            try:
+                overlapping = self.conflict_index() \
+                    .overlapping_virtual_servers(ip_address)
+            except ValueError as e:
+                raise errors.VCloudValidationError(
+                    'Invalid virtual server.',
+                    ['Virtual server {!r}: {} {!r}'.format(name, *e.args)])
+
+            for existing_virtual_server in overlapping:
+                raise errors.VCloudResourceConflict(
+                    'IP is already in use by an existing virtual server.',
+                    ip_address,
+                    existing_virtual_server.Name)
+
         load_balancer_service.append(virtual_server)
+        self._staged.append(virtual_server)
+        self._changed_services.add('LoadBalancerService')
 
-    def commit(self):
+        if self._conflict_index is not None:
+            self._conflict_index.add_virtual_server(virtual_server)
+
+    def validate(self):
+        """
+        Validate the firewall rules, pools and virtual servers staged since
+        the last load or commit, and raise with every error found.
+        """
+        pool_names = []
+        load_balancer_service = getattr(
+            self.config, 'LoadBalancerService', None)
+        if load_balancer_service is not None and \
+                hasattr(load_balancer_service, 'Pool'):
+            pool_names = [
+                pool.Name.text for pool in load_balancer_service.Pool]
+
+        validator = Validator(pool_names)
+        for element in self._staged:
+            validator.validate(element)
+
+        if validator.errors:
+            raise errors.VCloudValidationError(
+                'Invalid staged configuration.', validator.errors)
+
+    def commit(self, stream=False, validate=True, changed_only=False):
         """
         Commit the current edge gateway service configuration. Call after
-        calling one or more of the add_* methods.
+        calling one or more of the add_* or update_* methods.
+
+        :param stream: Send the configuration as it is serialized by
+        iter_xml instead of building it with to_xml first. Default False.
+        :param validate: Validate the staged configuration before sending it.
+        Default True.
+        :param changed_only: Only send the services changed since the last
+        load or commit, and send nothing if none changed. Default False.
         """
-        data = self.to_xml()
+        if validate:
+            self.validate()
+
+        services = None
+        if changed_only:
+            if not self._changed_services:
+                return
+            services = self._changed_services
+
+        if stream:
+            data = self.iter_xml(services)
+        else:
+            data = self.to_xml(services)
 
         url = '{}/action/configureServices'.format(
             self.edge_gateway.get('href'))
@@ -226,23 +576,61 @@ class EdgeGatewayDriver(object):
         if response.status_code < 400:
             task = objectify.fromstring(response.content)
             self._client.wait_for_task(task.get('href'))
+            self._staged = []
+            self._changed_services = set()
         else:
             raise errors.VCloudAPIError(
                 'Failure updating edge gateway.', response.content)
 
-    def to_xml(self):
+    def to_xml(self, services=None):
         """
         Return an xml string representation of the edge gateway configuration
         after cleaning up the namespaces.
 
+        :param services: Only include these services, by element name.
+        Default None, includes every service.
         :return: String representation of the edge gateway configuration.
         """
+        if services is not None:
+            return ''.join(self.iter_xml(services))
+
         tree = self.config
         objectify.deannotate(self.config, xsi_nil=True)
         etree.cleanup_namespaces(self.config)
         xml = etree.tostring(tree, pretty_print=True)
-        xml = re.sub(r'ns\d:', '', xml)
-        xml = re.sub(r'\sxmlns:ns\d=".*"', '', xml)
-        xml = re.sub(r'\sxmlns:xsi=".*"', '', xml)
 
-        return xml
+        return strip_namespaces(xml)
+
+    def iter_xml(self, services=None):
+        """
+        Yield the xml string representation of the edge gateway configuration
+        one service child, such as a FirewallRule or Pool, at a time, so
+        neither the document nor a large service is held as a single string.
+
+        :param services: Only include these services, by element name.
+        Default None, includes every service.
+        :return: Generator of xml strings.
+        """
+        objectify.deannotate(self.config, xsi_nil=True)
+        etree.cleanup_namespaces(self.config)
+
+        writer = _ChunkWriter()
+        with etree.xmlfile(writer, buffered=False) as xf:
+            with xf.element(
+                    self.config.tag,
+                    attrib=dict(self.config.attrib),
+                    nsmap=self.config.nsmap):
+                xf.write('\n')
+                for service in self.config.iterchildren():
+                    if services is not None and \
+                            _localname(service.tag) not in services:
+                        continue
+                    with xf.element(
+                            service.tag, attrib=dict(service.attrib)):
+                        xf.write('\n')
+                        for child in service.iterchildren():
+                            xf.write(child, pretty_print=True)
+                            yield strip_namespaces(writer.drain())
+                    xf.write('\n')
+
+        yield strip_namespaces(writer.drain())
@@ -16,3 +16,7 @@ class VCloudResourceConflict(Exception):
 
 class VCloudTimeoutError(Exception):
     pass
+
+
+class VCloudValidationError(Exception):
+    pass
@@ -0,0 +1,319 @@
+import random
+import re
+import socket
+import struct
+
+
+IP_MIN = 0
+IP_MAX = 2 ** 32 - 1
+PORT_MIN = 0
+PORT_MAX = 65535
+
+ANY_IP = ('any', 'internal', 'external')
+ANY_PORT = ('any', '-1')
+
+IP_PATTERN = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$')
+PORT_PATTERN = re.compile(r'^\d{1,5}$')
+
+
+def parse_ip(value):
+    """
+    Return the integer value of a dotted quad IPv4 address.
+
+    :param value: IP address string.
+    :return: IP address as an integer.
+    """
+    value = str(value).strip()
+    if not IP_PATTERN.match(value):
+        raise ValueError('Invalid IP address.', value)
+    try:
+        return struct.unpack('!I', socket.inet_aton(value))[0]
+    except socket.error:
+        raise ValueError('Invalid IP address.', value)
+
+
+def parse_ip_range(value):
+    """
+    Return the (low, high) bounds of an IP, IP range or CIDR. The VCD
+    keywords 'Any', 'internal' and 'external' match every address.
+
+    :param value: IP, IP range such as '10.0.0.1-10.0.0.9' or CIDR such as
+    '10.0.0.0/24'.
+    :return: Tuple of integer bounds.
+    """
+    value = str(value).strip()
+    if value.lower() in ANY_IP:
+        return IP_MIN, IP_MAX
+
+    if '/' in value:
+        address, prefix = value.split('/', 1)
+        if not PORT_PATTERN.match(prefix) or int(prefix) > 32:
+            raise ValueError('Invalid CIDR prefix.', value)
+        mask = (IP_MAX << (32 - int(prefix))) & IP_MAX
+        low = parse_ip(address) & mask
+        return low, low | (~mask & IP_MAX)
+
+    if '-' in value:
+        low, high = [parse_ip(part) for part in value.split('-', 1)]
+        if low > high:
+            raise ValueError('Invalid IP range.', value)
+        return low, high
+
+    address = parse_ip(value)
+    return address, address
+
+
+def parse_port(value):
+    """
+    Return the integer value of a single port.
+
+    :param value: Port.
+    :return: Port as an integer.
+    """
+    value = str(value).strip()
+    if not PORT_PATTERN.match(value) or int(value) > PORT_MAX:
+        raise ValueError('Invalid port.', value)
+    return int(value)
+
+
+def parse_port_range(value):
+    """
+    Return the (low, high) bounds of a port or port range. 'Any' and -1
+    match every port.
+
+    :param value: Port or port range such as '8000-8080'.
+    :return: Tuple of integer bounds.
+    """
+    value = str(value).strip()
+    if value.lower() in ANY_PORT:
+        return PORT_MIN, PORT_MAX
+
+    parts = value.split('-', 1)
+    for part in parts:
+        if not PORT_PATTERN.match(part) or int(part) > PORT_MAX:
+            raise ValueError('Invalid port.', value)
+
+    low, high = int(parts[0]), int(parts[-1])
+    if low > high:
+        raise ValueError('Invalid port range.', value)
+    return low, high
+
+
+class _Node(object):
+    __slots__ = (
+        'low', 'high', 'value', 'priority', 'max', 'left', 'right')
+
+    def __init__(self, low, high, value):
+        self.low = low
+        self.high = high
+        self.value = value
+        self.priority = random.random()
+        self.max = high
+        self.left = None
+        self.right = None
+
+    def update(self):
+        self.max = self.high
+        if self.left and self.left.max > self.max:
+            self.max = self.left.max
+        if self.right and self.right.max > self.max:
+            self.max = self.right.max
+
+
+class IntervalTree(object):
+    """
+    Balanced tree of closed intervals that answers overlap queries in
+    O(log n + k) time.
+    """
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, low, high, value):
+        """
+        Add an interval to the tree.
+
+        :param low: Lower bound, inclusive.
+        :param high: Upper bound, inclusive.
+        :param value: Value returned by overlap queries.
+        """
+        self._root = self._insert(self._root, _Node(low, high, value))
+        self._size += 1
+
+    def _insert(self, node, new):
+        if node is None:
+            return new
+
+        if new.low < node.low:
+            node.left = self._insert(node.left, new)
+            if node.left.priority > node.priority:
+                node = self._rotate_right(node)
+        else:
+            node.right = self._insert(node.right, new)
+            if node.right.priority > node.priority:
+                node = self._rotate_left(node)
+
+        node.update()
+        return node
+
+    @staticmethod
+    def _rotate_right(node):
+        left = node.left
+        node.left = left.right
+        left.right = node
+        node.update()
+        left.update()
+        return left
+
+    @staticmethod
+    def _rotate_left(node):
+        right = node.right
+        node.right = right.left
+        right.left = node
+        node.update()
+        right.update()
+        return right
+
+    def overlap(self, low, high):
+        """
+        Return the values of the intervals overlapping [low, high].
+
+        :param low: Lower bound, inclusive.
+        :param high: Upper bound, inclusive.
+        :return: List of values.
+        """
+        results = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.max < low:
+                continue
+            stack.append(node.left)
+            if node.low <= high:
+                if node.high >= low:
+                    results.append(node.value)
+                stack.append(node.right)
+
+        return results
+
+
+def _text(element, tag, default='Any'):
+    child = getattr(element, tag, None)
+    if child is None or child.text is None:
+        return default
+    return child.text
+
+
+def _protocols(rule):
+    protocols = getattr(rule, 'Protocols', None)
+    if protocols is None:
+        return None
+
+    names = set(
+        protocol.tag.rsplit('}', 1)[-1].lower()
+        for protocol in protocols.iterchildren()
+        if str(protocol.text).lower() == 'true')
+    if not names or 'any' in names:
+        return None
+    return names
+
+
+def _overlaps(one, other):
+    return one[0] <= other[1] and other[0] <= one[1]
+
+
+class ConflictIndex(object):
+    """
+    Index of the firewall rules and virtual servers of an edge gateway
+    service configuration by IP and port ranges. Elements with ranges that
+    can't be parsed are not indexed.
+    """
+    def __init__(self, config=None):
+        self._rules = IntervalTree()
+        self._virtual_servers = IntervalTree()
+
+        if config is None:
+            return
+
+        firewall_service = getattr(config, 'FirewallService', None)
+        if firewall_service is not None and \
+                hasattr(firewall_service, 'FirewallRule'):
+            for rule in firewall_service.FirewallRule:
+                self.add_firewall_rule(rule)
+
+        load_balancer_service = getattr(config, 'LoadBalancerService', None)
+        if load_balancer_service is not None and \
+                hasattr(load_balancer_service, 'VirtualServer'):
+            for virtual_server in load_balancer_service.VirtualServer:
+                self.add_virtual_server(virtual_server)
+
+    def add_firewall_rule(self, rule):
+        """
+        Add a firewall rule to the index.
+
+        :param rule: FirewallRule as an ObjectifiedElement.
+        """
+        try:
+            dest_ip = parse_ip_range(_text(rule, 'DestinationIp'))
+            src_ip = parse_ip_range(_text(rule, 'SourceIp'))
+            dest_port = parse_port_range(
+                _text(rule, 'DestinationPortRange', _text(rule, 'Port')))
+        except ValueError:
+            return
+
+        self._rules.add(
+            dest_ip[0], dest_ip[1],
+            (rule, src_ip, dest_port, _protocols(rule)))
+
+    def add_virtual_server(self, virtual_server):
+        """
+        Add a virtual server to the index.
+
+        :param virtual_server: VirtualServer as an ObjectifiedElement.
+        """
+        try:
+            ip = parse_ip_range(_text(virtual_server, 'IpAddress', None))
+        except ValueError:
+            return
+
+        self._virtual_servers.add(ip[0], ip[1], virtual_server)
+
+    def overlapping_firewall_rules(
+            self, src_ip_range='Any', dest_ip_range='Any',
+            dest_port_range='Any', protocol='Any'):
+        """
+        Return the indexed firewall rules whose source IPs, destination IPs,
+        destination ports and protocols all overlap the arguments.
+
+        :param src_ip_range: Source ip, ip range or CIDR.
+        :param dest_ip_range: Destination ip, ip range or CIDR.
+        :param dest_port_range: Destination port or port range.
+        :param protocol: Protocol name. Default 'Any'.
+        :return: List of FirewallRule ObjectifiedElements.
+        """
+        src_ip = parse_ip_range(src_ip_range)
+        dest_ip = parse_ip_range(dest_ip_range)
+        dest_port = parse_port_range(dest_port_range)
+        protocol = str(protocol).lower()
+
+        return [
+            rule
+            for rule, rule_src_ip, rule_dest_port, rule_protocols
+            in self._rules.overlap(*dest_ip)
+            if _overlaps(src_ip, rule_src_ip) and
+            _overlaps(dest_port, rule_dest_port) and
+            (protocol == 'any' or rule_protocols is None or
+             protocol in rule_protocols)
+        ]
+
+    def overlapping_virtual_servers(self, ip_range):
+        """
+        Return the indexed virtual servers whose IP is in a range.
+
+        :param ip_range: IP, IP range or CIDR.
+        :return: List of VirtualServer ObjectifiedElements.
+        """
+        return self._virtual_servers.overlap(*parse_ip_range(ip_range))
@@ -1,8 +1,88 @@
+import threading
+
 from lxml import objectify
 
 import errors
 
 
+NETWORK_QUERIES = (
+    ('orgNetwork', 'OrgNetworkRecord'),
+    ('externalNetwork', 'NetworkRecord'),
+)
+
+
+class NetworkInventory(object):
+    """
+    Networks as lxml ObjectifiedElement objects indexed by name, href and
+    connected edge gateway. Iterating the inventory yields the networks in
+    query order.
+    """
+    def __init__(self, networks):
+        self._networks = list(networks)
+        self._by_name = {}
+        self._by_href = {}
+        self._by_gateway = {}
+
+        for network in self._networks:
+            self._by_name.setdefault(network.get('name'), network)
+            self._by_href.setdefault(network.get('href'), network)
+            gateway = network.get('connectedTo')
+            if gateway:
+                self._by_gateway.setdefault(gateway, []).append(network)
+
+    def __iter__(self):
+        return iter(self._networks)
+
+    def __len__(self):
+        return len(self._networks)
+
+    def get_by_name(self, name):
+        """
+        Return the network for the name specified.
+
+        :param name: Network name.
+        :return: Network represented as an ObjectifiedElement.
+        """
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise errors.VCloudNotFoundError('No network found.', name)
+
+    def get_by_names(self, names):
+        """
+        Return the networks for the names specified, in the same order.
+
+        :param names: List of network names.
+        :return: List of networks represented as ObjectifiedElements.
+        """
+        missing = [name for name in names if name not in self._by_name]
+        if missing:
+            raise errors.VCloudNotFoundError('No network found.', *missing)
+
+        return [self._by_name[name] for name in names]
+
+    def get_by_href(self, href):
+        """
+        Return the network for the href specified.
+
+        :param href: Network href.
+        :return: Network represented as an ObjectifiedElement.
+        """
+        try:
+            return self._by_href[href]
+        except KeyError:
+            raise errors.VCloudNotFoundError('No network found.', href)
+
+    def get_by_gateway(self, gateway):
+        """
+        Return the networks connected to an edge gateway.
+
+        :param gateway: Edge gateway name.
+        :return: List of networks represented as ObjectifiedElements.
+        """
+        return list(self._by_gateway.get(gateway, []))
+
+
 class NetworkDriver(object):
     """
     Use the NetworkDriver to query information about VCD networks.
@@ -13,29 +93,42 @@ class NetworkDriver(object):
 
     def get_networks(self):
         """
-        Return a list of networks as lxml ObjectifiedElement objects.
+        Return an inventory of org and external networks. Both network types
+        are queried concurrently.
 
-        :return: List of networks represented as ObjectifiedElement objects.
+        :return: NetworkInventory of networks represented as
+        ObjectifiedElement objects.
         """
-        networks = []
+        results = [None] * len(NETWORK_QUERIES)
 
-        # Get org networks.
-        response = self._client.request(
-            'GET', self._client.url('query?type=orgNetwork'))
-        records = objectify.fromstring(response.content)
+        def query(position, query_type, record_type):
+            try:
+                response = self._client.request(
+                    'GET', self._client.url('query?type=' + query_type))
+                records = objectify.fromstring(response.content)
+                results[position] = list(getattr(records, record_type, []))
+            except Exception as e:
+                results[position] = e
 
-        for record in records.OrgNetworkRecord:
-            networks.append(record)
+        threads = []
+        for position, (query_type, record_type) in \
+                enumerate(NETWORK_QUERIES):
+            thread = threading.Thread(
+                target=query, args=(position, query_type, record_type))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
 
-        # Get external network.
-        response = self._client.request(
-            'GET', self._client.url('query?type=externalNetwork'))
-        records = objectify.fromstring(response.content)
+        for thread in threads:
+            thread.join()
 
-        for record in records.NetworkRecord:
-            networks.append(record)
+        networks = []
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+            networks.extend(result)
 
-        return networks
+        return NetworkInventory(networks)
 
     def get_network_by_name(self, name):
         """
@@ -45,10 +138,14 @@ class NetworkDriver(object):
         :param name: Network name.
         :return: Network represented as an ObjectifiedElement.
         """
-        networks = self.get_networks()
+        return self.get_networks().get_by_name(name)
 
-        for network in networks:
-            if network.get('name') == name:
-                return network
-        else:
-            raise errors.VCloudNotFoundError('No network found.', name)
+    def get_networks_by_names(self, names):
+        """
+        Return the networks as lxml ObjectifiedElement objects for the names
+        specified, using a single inventory query.
+
+        :param names: List of network names.
+        :return: List of networks represented as ObjectifiedElements.
+        """
+        return self.get_networks().get_by_names(names)
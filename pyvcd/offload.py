@@ -0,0 +1,71 @@
+import multiprocessing
+import threading
+
+
+class InProcessBackend(object):
+    """
+    Backend that runs XML parse work in the calling thread.
+    """
+    def apply(self, func, content, *args):
+        """
+        Return func(content, *args).
+
+        :param func: Function taking an xml string.
+        :param content: Xml string.
+        :return: Result of func.
+        """
+        return func(content, *args)
+
+    def close(self):
+        pass
+
+
+class ProcessPoolBackend(object):
+    """
+    Backend that runs XML parse work on documents of at least `threshold`
+    bytes in a pool of worker processes, so that the work of many threads
+    isn't serialized by the GIL. Used by SnapshotStore.refresh. Smaller
+    documents are handled in the calling thread, where the cost of sending
+    them to a worker would outweigh the work.
+
+    Functions given to apply must be module level functions, and their
+    arguments and results must be picklable. Return compact results, such as
+    tuples or strings, rather than element trees.
+
+    The worker processes are forked when the backend is created. Create it
+    before starting any threads, so that no worker inherits locks held by
+    other threads.
+    """
+    def __init__(self, processes=None, threshold=256 * 1024):
+        self.processes = processes
+        self.threshold = threshold
+        self._pool = multiprocessing.Pool(processes)
+        self._lock = threading.Lock()
+
+    def apply(self, func, content, *args):
+        """
+        Return func(content, *args), computed in a worker process if the
+        content is at least threshold bytes and the backend isn't closed.
+
+        :param func: Module level function taking an xml string.
+        :param content: Xml string.
+        :return: Result of func.
+        """
+        with self._lock:
+            pool = self._pool
+
+        if pool is None or len(content) < self.threshold:
+            return func(content, *args)
+
+        return pool.apply(func, (content,) + args)
+
+    def close(self):
+        """
+        Stop the worker processes. Later calls to apply run in the calling
+        thread.
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
@@ -0,0 +1,478 @@
+import hashlib
+from Queue import Queue
+import sqlite3
+import threading
+import time
+
+from lxml import objectify
+
+from intervals import parse_port_range
+from network import NetworkDriver
+from offload import InProcessBackend
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS gateways (
+    name TEXT PRIMARY KEY,
+    href TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    refreshed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS firewall_rules (
+    gateway TEXT NOT NULL,
+    description TEXT,
+    policy TEXT,
+    protocols TEXT,
+    source_ip TEXT,
+    source_port_range TEXT,
+    destination_ip TEXT,
+    destination_port_range TEXT,
+    port_low INTEGER,
+    port_high INTEGER,
+    enabled INTEGER
+);
+CREATE TABLE IF NOT EXISTS pools (
+    gateway TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT
+);
+CREATE TABLE IF NOT EXISTS pool_members (
+    gateway TEXT NOT NULL,
+    pool TEXT NOT NULL,
+    ip_address TEXT,
+    port TEXT,
+    weight TEXT
+);
+CREATE TABLE IF NOT EXISTS virtual_servers (
+    gateway TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ip_address TEXT,
+    pool TEXT,
+    network TEXT
+);
+CREATE TABLE IF NOT EXISTS networks (
+    name TEXT NOT NULL,
+    href TEXT,
+    type TEXT,
+    gateway TEXT
+);
+CREATE INDEX IF NOT EXISTS firewall_rules_gateway
+    ON firewall_rules (gateway);
+CREATE INDEX IF NOT EXISTS firewall_rules_ports
+    ON firewall_rules (port_low, port_high);
+CREATE INDEX IF NOT EXISTS firewall_rules_destination_ip
+    ON firewall_rules (destination_ip);
+CREATE INDEX IF NOT EXISTS pools_gateway ON pools (gateway, name);
+CREATE INDEX IF NOT EXISTS pool_members_gateway
+    ON pool_members (gateway, pool);
+CREATE INDEX IF NOT EXISTS pool_members_ip ON pool_members (ip_address);
+CREATE INDEX IF NOT EXISTS virtual_servers_gateway
+    ON virtual_servers (gateway);
+CREATE INDEX IF NOT EXISTS virtual_servers_ip
+    ON virtual_servers (ip_address);
+CREATE INDEX IF NOT EXISTS networks_name ON networks (name);
+CREATE INDEX IF NOT EXISTS networks_gateway ON networks (gateway);
+"""
+
+GATEWAY_TABLES = (
+    'firewall_rules',
+    'pools',
+    'pool_members',
+    'virtual_servers',
+)
+
+# Protocols whose rules have destination ports.
+PORT_PROTOCOLS = ('tcp', 'udp', 'any')
+
+
+def _localname(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(element, tag, default=None):
+    child = getattr(element, tag, None)
+    if child is None:
+        return default
+    return child.text
+
+
+def _children(element, tag):
+    if element is None or not hasattr(element, tag):
+        return []
+    return getattr(element, tag)
+
+
+def fingerprint(record):
+    """
+    Return a fingerprint of an EdgeGatewayRecord. A gateway is only fetched
+    again during an incremental refresh if its fingerprint changes.
+
+    :param record: EdgeGatewayRecord as an ObjectifiedElement.
+    :return: Hex digest of the record attributes.
+    """
+    items = sorted(record.attrib.items())
+    return hashlib.sha1(repr(items)).hexdigest()
+
+
+def gateway_rows(content):
+    """
+    Return the snapshot rows for an edge gateway document. The result only
+    holds plain tuples so it can be computed away from the snapshot
+    connection.
+
+    :param content: Edge gateway xml document.
+    :return: Dict of table name to a list of row tuples, without the
+    gateway column.
+    """
+    edge_gateway = objectify.fromstring(content)
+    config = edge_gateway.Configuration.EdgeGatewayServiceConfiguration
+
+    rows = dict((table, []) for table in GATEWAY_TABLES)
+
+    firewall_service = getattr(config, 'FirewallService', None)
+    for rule in _children(firewall_service, 'FirewallRule'):
+        protocols = getattr(rule, 'Protocols', None)
+        names = []
+        if protocols is not None:
+            names = [
+                _localname(protocol.tag).lower()
+                for protocol in protocols.iterchildren()
+                if str(protocol.text).lower() == 'true'
+            ]
+        port_range = _text(rule, 'DestinationPortRange', _text(rule, 'Port'))
+        try:
+            port_low, port_high = parse_port_range(
+                port_range if port_range is not None else 'Any')
+        except ValueError:
+            port_low, port_high = None, None
+        rows['firewall_rules'].append((
+            _text(rule, 'Description'),
+            str(_text(rule, 'Policy', '')).lower(),
+            ','.join(sorted(names)),
+            _text(rule, 'SourceIp'),
+            _text(rule, 'SourcePortRange'),
+            _text(rule, 'DestinationIp'),
+            port_range,
+            port_low,
+            port_high,
+            int(str(_text(rule, 'IsEnabled', 'true')).lower() == 'true'),
+        ))
+
+    load_balancer_service = getattr(config, 'LoadBalancerService', None)
+    for pool in _children(load_balancer_service, 'Pool'):
+        pool_name = _text(pool, 'Name')
+        rows['pools'].append((pool_name, _text(pool, 'Description')))
+
+        for member in _children(pool, 'Member'):
+            service_port = getattr(member, 'ServicePort', None)
+            rows['pool_members'].append((
+                pool_name,
+                _text(member, 'IpAddress'),
+                _text(service_port, 'Port') if service_port is not None
+                else None,
+                _text(member, 'Weight'),
+            ))
+
+    for virtual_server in _children(load_balancer_service, 'VirtualServer'):
+        interface = getattr(virtual_server, 'Interface', None)
+        rows['virtual_servers'].append((
+            _text(virtual_server, 'Name'),
+            _text(virtual_server, 'IpAddress'),
+            _text(virtual_server, 'Pool'),
+            interface.get('name') if interface is not None else None,
+        ))
+
+    return rows
+
+
+class SnapshotStore(object):
+    """
+    Use the SnapshotStore to keep a local SQLite snapshot of the edge
+    gateways and networks of an organization and to query it without
+    calling the VCD API. Requires a VCloudClient object that has already been
+    authenticated.
+
+    Gateway documents are turned into rows on the backend, so a
+    ProcessPoolBackend spreads the parsing of large gateways over worker
+    processes.
+    """
+    def __init__(self, client, path=':memory:', workers=8, backend=None):
+        self._client = client
+        self._backend = backend or InProcessBackend()
+        self.path = path
+        self.workers = workers
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def refresh(self, full=False):
+        """
+        Refresh the snapshot. Only gateways whose query record changed since
+        the last refresh are fetched again, unless full is set. Gateways that
+        no longer exist are removed.
+
+        :param full: Fetch every gateway. Default False.
+        :return: List of names of the gateways whose rows were rewritten.
+        """
+        response = self._client.request(
+            'GET', self._client.url('query?type=edgeGateway'))
+        records = objectify.fromstring(response.content)
+
+        known = dict(
+            (row['name'], (row['href'], row['fingerprint'], row['digest']))
+            for row in self.connection.execute(
+                'SELECT name, href, fingerprint, digest FROM gateways'))
+
+        stale = []
+        names = set()
+        for record in _children(records, 'EdgeGatewayRecord'):
+            name = record.get('name')
+            href = record.get('href')
+            names.add(name)
+            record_fingerprint = fingerprint(record)
+            previous = known.get(name)
+            if full or not previous or \
+                    previous[:2] != (href, record_fingerprint):
+                stale.append((
+                    name, href, record_fingerprint,
+                    previous[2] if previous else None))
+
+        updated = []
+        with self.connection:
+            for name in set(known) - names:
+                self._delete_gateway(name)
+
+            for name, href, record_fingerprint, digest, rows in \
+                    self._fetch(stale):
+                if rows is None:
+                    self.connection.execute(
+                        'UPDATE gateways SET href = ?, fingerprint = ?, '
+                        'refreshed = ? WHERE name = ?',
+                        (href, record_fingerprint, time.time(), name))
+                    continue
+
+                self._write_gateway(
+                    name, href, record_fingerprint, digest, rows)
+                updated.append(name)
+
+            self._write_networks()
+
+        return updated
+
+    def _fetch(self, gateways):
+        """
+        Fetch and parse gateway documents with at most self.workers
+        requests in flight, yielding each one as it is ready. Rows are None
+        if the document digest did not change.
+        """
+        if not gateways:
+            return
+
+        pending = Queue()
+        results = Queue()
+        for gateway in gateways:
+            pending.put(gateway)
+
+        def worker():
+            while True:
+                gateway = pending.get()
+                if gateway is None:
+                    return
+                name, href, record_fingerprint, previous_digest = gateway
+                try:
+                    response = self._client.request('GET', href)
+                    digest = hashlib.sha1(response.content).hexdigest()
+                    rows = None
+                    if digest != previous_digest:
+                        rows = self._backend.apply(
+                            gateway_rows, response.content)
+                    results.put(
+                        (name, href, record_fingerprint, digest, rows))
+                except Exception as e:
+                    results.put(e)
+
+        threads = []
+        for _ in xrange(min(self.workers, len(gateways))):
+            pending.put(None)
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        error = None
+        for _ in xrange(len(gateways)):
+            result = results.get()
+            if isinstance(result, Exception):
+                error = error or result
+            elif not error:
+                yield result
+
+        for thread in threads:
+            thread.join()
+
+        if error:
+            raise error
+
+    def _delete_gateway(self, name):
+        for table in GATEWAY_TABLES:
+            self.connection.execute(
+                'DELETE FROM {} WHERE gateway = ?'.format(table), (name,))
+        self.connection.execute('DELETE FROM gateways WHERE name = ?', (name,))
+
+    def _write_gateway(self, name, href, record_fingerprint, digest, rows):
+        self._delete_gateway(name)
+        self.connection.execute(
+            'INSERT INTO gateways VALUES (?, ?, ?, ?, ?)',
+            (name, href, record_fingerprint, digest, time.time()))
+
+        for table in GATEWAY_TABLES:
+            if not rows[table]:
+                continue
+            placeholders = ', '.join('?' * (len(rows[table][0]) + 1))
+            self.connection.executemany(
+                'INSERT INTO {} VALUES ({})'.format(table, placeholders),
+                ((name,) + row for row in rows[table]))
+
+    def _write_networks(self):
+        networks = NetworkDriver(self._client).get_networks()
+
+        self.connection.execute('DELETE FROM networks')
+        self.connection.executemany(
+            'INSERT INTO networks VALUES (?, ?, ?, ?)',
+            ((network.get('name'),
+              network.get('href'),
+              _localname(network.tag),
+              network.get('connectedTo'))
+             for network in networks))
+
+    def _select(self, table, **filters):
+        clauses = []
+        values = []
+        for column, value in sorted(filters.items()):
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                values.append(value)
+
+        sql = 'SELECT * FROM {}'.format(table)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+
+        return [dict(row) for row in self.connection.execute(sql, values)]
+
+    def gateways(self):
+        """
+        Return the names of the gateways in the snapshot.
+
+        :return: List of gateway names.
+        """
+        return [
+            row['name'] for row in self.connection.execute(
+                'SELECT name FROM gateways ORDER BY name')]
+
+    def firewall_rules(
+            self, gateway=None, policy=None, port=None, enabled=None):
+        """
+        Return the firewall rules in the snapshot as dicts.
+
+        :param gateway: Only return rules of this gateway.
+        :param policy: Only return rules with this policy, e.g. 'allow'.
+        :param port: Only return TCP, UDP or Any protocol rules whose
+        destination port range includes this port.
+        :param enabled: Only return enabled rules if True, or disabled rules
+        if False. Default None, returns both.
+        :return: List of firewall rules.
+        """
+        clauses = []
+        values = []
+        if gateway is not None:
+            clauses.append('gateway = ?')
+            values.append(gateway)
+        if policy is not None:
+            clauses.append('policy = ?')
+            values.append(policy.lower())
+        if port is not None:
+            clauses.append('port_low <= ? AND port_high >= ?')
+            values.extend([int(port), int(port)])
+            clauses.append('({})'.format(' OR '.join(
+                "',' || protocols || ',' LIKE ?" for _ in PORT_PROTOCOLS)))
+            values.extend(
+                '%,{},%'.format(protocol) for protocol in PORT_PROTOCOLS)
+        if enabled is not None:
+            clauses.append('enabled = ?')
+            values.append(int(enabled))
+
+        sql = 'SELECT * FROM firewall_rules'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+
+        return [dict(row) for row in self.connection.execute(sql, values)]
+
+    def rules_allowing_port(self, port):
+        """
+        Return the enabled TCP, UDP or Any protocol allow rules whose
+        destination port range includes a port.
+
+        :param port: Destination port.
+        :return: List of firewall rules.
+        """
+        return self.firewall_rules(policy='allow', port=port, enabled=True)
+
+    def pools(self, gateway=None, name=None):
+        """
+        Return the load balancer pools in the snapshot as dicts.
+
+        :param gateway: Only return pools of this gateway.
+        :param name: Only return pools with this name.
+        :return: List of pools.
+        """
+        return self._select('pools', gateway=gateway, name=name)
+
+    def pool_members(self, gateway=None, pool=None, ip_address=None):
+        """
+        Return the load balancer pool members in the snapshot as dicts.
+
+        :param gateway: Only return members of this gateway.
+        :param pool: Only return members of this pool.
+        :param ip_address: Only return members with this IP.
+        :return: List of pool members.
+        """
+        return self._select(
+            'pool_members', gateway=gateway, pool=pool, ip_address=ip_address)
+
+    def virtual_servers(self, gateway=None, ip_address=None, pool=None):
+        """
+        Return the load balancer virtual servers in the snapshot as dicts.
+
+        :param gateway: Only return virtual servers of this gateway.
+        :param ip_address: Only return virtual servers with this VIP.
+        :param pool: Only return virtual servers using this pool.
+        :return: List of virtual servers.
+        """
+        return self._select(
+            'virtual_servers', gateway=gateway, ip_address=ip_address,
+            pool=pool)
+
+    def gateways_with_vip(self, ip_address):
+        """
+        Return the names of the gateways with a virtual server on an IP.
+
+        :param ip_address: Virtual server IP.
+        :return: List of gateway names.
+        """
+        return sorted(set(
+            row['gateway'] for row in
+            self.virtual_servers(ip_address=ip_address)))
+
+    def networks(self, name=None, gateway=None):
+        """
+        Return the networks in the snapshot as dicts.
+
+        :param name: Only return networks with this name.
+        :param gateway: Only return networks connected to this gateway.
+        :return: List of networks.
+        """
+        return self._select('networks', name=name, gateway=gateway)
+
+    def close(self):
+        self.connection.close()
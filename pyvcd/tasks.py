@@ -0,0 +1,183 @@
+from collections import namedtuple, OrderedDict
+import threading
+
+from lxml import etree
+
+
+TASK_STATUSES = {
+    'com/vmware/vcloud/event/task/complete': 'success',
+    'com/vmware/vcloud/event/task/fail': 'error',
+    'com/vmware/vcloud/event/task/abort': 'aborted',
+}
+
+Delivery = namedtuple('Delivery', ['routing_key', 'delivery_tag'])
+
+
+def task_id(reference):
+    """
+    Return the id of a task from its href or urn.
+
+    :param reference: Task href such as 'https://host/api/task/<id>' or urn
+    such as 'urn:vcloud:task:<id>'.
+    :return: Task id.
+    """
+    return reference.rstrip('/').rsplit('/', 1)[-1].rsplit(':', 1)[-1]
+
+
+def parse_notification(body):
+    """
+    Return the task id and final status of a VCD task notification message.
+
+    :param body: Notification xml document.
+    :return: Tuple of task id and status, or None if the message is not a
+    task completion.
+    """
+    notification = etree.fromstring(body)
+    notification_type = notification.get('type')
+    if notification_type not in TASK_STATUSES:
+        return None
+
+    status = TASK_STATUSES[notification_type]
+    if status == 'success' and \
+            notification.get('operationSuccess', 'true').lower() != 'true':
+        status = 'error'
+
+    for link in notification.iter('{*}Link', '{*}EntityLink'):
+        if link.get('rel') != 'entity':
+            continue
+        reference = link.get('href') or link.get('id')
+        if reference:
+            return task_id(reference), status
+
+    return None
+
+
+class NotificationTaskSource(object):
+    """
+    Use the NotificationTaskSource to resolve VCloudClient.wait_for_task from
+    VCD task notification messages instead of polling. Register on_message as
+    the consumer callback of an AMQP channel bound to the VCD notification
+    exchange and assign the source to VCloudClient.task_source.
+    """
+    def __init__(self, deadline=60, history=1024):
+        self.deadline = deadline
+        self.history = history
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._results = OrderedDict()
+
+    def on_message(self, channel, method, properties, body):
+        """
+        Consumer callback for a notification message. Has the same signature
+        as a pika consumer callback. Every message is acknowledged, including
+        messages that are ignored or can't be parsed, so the broker keeps
+        delivering under a prefetch limit.
+
+        :param channel: Channel the message was delivered on.
+        :param method: Delivery method frame.
+        :param properties: Message properties.
+        :param body: Notification xml document.
+        """
+        try:
+            self._handle(body)
+        finally:
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _handle(self, body):
+        try:
+            result = parse_notification(body)
+        except etree.XMLSyntaxError:
+            return
+
+        if result is None:
+            return
+
+        task, status = result
+        with self._lock:
+            self._results[task] = status
+            while len(self._results) > self.history:
+                self._results.popitem(last=False)
+            waiters = self._waiters.pop(task, [])
+
+        for waiter in waiters:
+            waiter.set()
+
+    def wait(self, task_url, timeout=None):
+        """
+        Wait for the completion notification of a task.
+
+        :param task_url: Url of the task.
+        :param timeout: Seconds to wait. Default self.deadline.
+        :return: Final task status, or None if no notification arrived before
+        the deadline.
+        """
+        task = task_id(task_url)
+
+        with self._lock:
+            if task in self._results:
+                return self._results[task]
+            waiter = threading.Event()
+            self._waiters.setdefault(task, []).append(waiter)
+
+        waiter.wait(self.deadline if timeout is None else timeout)
+
+        with self._lock:
+            waiters = self._waiters.get(task, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[task]
+            return self._results.get(task)
+
+
+class LocalBroker(object):
+    """
+    In-process stand-in for an AMQP channel. Published messages are
+    delivered to every consumer on the publishing thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._consumers = []
+        self._delivery_tag = 0
+        self.acked = []
+
+    def basic_consume(self, callback):
+        """
+        Register a consumer callback.
+
+        :param callback: Callable taking channel, method, properties and body.
+        """
+        with self._lock:
+            self._consumers.append(callback)
+
+    def basic_publish(self, body, routing_key='', properties=None):
+        """
+        Deliver a message to every consumer.
+
+        :param body: Message body.
+        :param routing_key: Message routing key.
+        :param properties: Message properties.
+        """
+        with self._lock:
+            self._delivery_tag += 1
+            method = Delivery(routing_key, self._delivery_tag)
+            consumers = list(self._consumers)
+
+        for callback in consumers:
+            callback(self, method, properties, body)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        """
+        Acknowledge a delivery.
+
+        :param delivery_tag: Delivery tag of the message.
+        :param multiple: Also acknowledge every earlier delivery. Default
+        False.
+        """
+        with self._lock:
+            if multiple:
+                self.acked.extend(
+                    tag for tag in xrange(1, delivery_tag + 1)
+                    if tag not in self.acked)
+            else:
+                self.acked.append(delivery_tag)
@@ -0,0 +1,179 @@
+import base64
+from collections import deque
+import hashlib
+import json
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import errors
+
+
+REDACTED_HEADERS = ('x-vcloud-authorization',)
+REDACTED = 'redacted'
+
+
+class RequestsTransport(object):
+    """
+    Transport that sends requests to the VCD API with the requests library.
+    Each thread gets its own requests Session, so connections are reused
+    within a thread and never shared between threads.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def session(self):
+        """
+        Return the requests Session of the current thread.
+
+        :return: Session object.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request and return the response.
+
+        :param method: Request method.
+        :param url: Request url.
+        :param kwargs: Keyword arguments of requests.request.
+        :return: Response object.
+        """
+        return self.session().request(method, url, **kwargs)
+
+
+class RecordedResponse(object):
+    """
+    Response served by a ReplayTransport. Has the attributes of a requests
+    Response that pyvcd uses.
+    """
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+
+class RecordingTransport(object):
+    """
+    Transport that passes requests to another transport and appends each
+    request/response exchange and its duration to a JSON lines file.
+    Auth tokens are redacted, request bodies are recorded only as a digest.
+    """
+    def __init__(self, path, transport=None):
+        self.path = path
+        self._transport = transport or RequestsTransport()
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the wrapped transport and record it.
+
+        :param method: Request method.
+        :param url: Request url.
+        :param kwargs: Keyword arguments of requests.request.
+        :return: Response object.
+        """
+        data = kwargs.get('data')
+        body = hashlib.sha1()
+        if data is not None and not isinstance(data, basestring):
+            kwargs['data'] = self._tee(data, body)
+        elif data is not None:
+            body.update(data)
+
+        started = time.time()
+        response = self._transport.request(method, url, **kwargs)
+        elapsed = time.time() - started
+
+        headers = dict(response.headers)
+        for name in headers:
+            if name.lower() in REDACTED_HEADERS:
+                headers[name] = REDACTED
+
+        exchange = {
+            'method': method.upper(),
+            'url': url,
+            'body': body.hexdigest() if data is not None else None,
+            'status_code': response.status_code,
+            'headers': headers,
+            'content': base64.b64encode(response.content or ''),
+            'elapsed': elapsed,
+        }
+        with self._lock:
+            with open(self.path, 'a') as stream:
+                stream.write(json.dumps(exchange, sort_keys=True) + '\n')
+
+        return response
+
+    @staticmethod
+    def _tee(chunks, body):
+        for chunk in chunks:
+            body.update(chunk)
+            yield chunk
+
+
+class ReplayTransport(object):
+    """
+    Transport that serves the exchanges of a RecordingTransport file. Each
+    method and url pair is answered with its recorded responses in order, so
+    a replay is deterministic even when requests to different urls are made
+    concurrently.
+    """
+    def __init__(self, path, latency=False):
+        self.path = path
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._exchanges = {}
+
+        with open(path) as stream:
+            for line in stream:
+                if not line.strip():
+                    continue
+                exchange = json.loads(line)
+                key = (exchange['method'], exchange['url'])
+                self._exchanges.setdefault(key, deque()).append(exchange)
+
+    def request(self, method, url, **kwargs):
+        """
+        Return the next recorded response for a method and url. Generator
+        and file-like request bodies are consumed as they would be by a real
+        transport.
+
+        :param method: Request method.
+        :param url: Request url.
+        :param kwargs: Keyword arguments of requests.request.
+        :return: RecordedResponse object.
+        """
+        with self._lock:
+            exchanges = self._exchanges.get((method.upper(), url))
+            if not exchanges:
+                raise errors.VCloudNotFoundError(
+                    'No recorded exchange.', method, url)
+            exchange = exchanges.popleft()
+
+        data = kwargs.get('data')
+        if data is not None and not isinstance(data, basestring):
+            for _ in data:
+                pass
+
+        if self.latency:
+            time.sleep(exchange['elapsed'])
+
+        return RecordedResponse(
+            exchange['status_code'],
+            exchange['headers'],
+            base64.b64decode(exchange['content']))
+
+    def remaining(self):
+        """
+        Return the number of recorded exchanges that have not been served.
+
+        :return: Number of exchanges.
+        """
+        with self._lock:
+            return sum(len(exchanges) for exchanges in
+                       self._exchanges.values())
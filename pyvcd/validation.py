@@ -0,0 +1,209 @@
+from intervals import parse_ip, parse_ip_range, parse_port, parse_port_range
+
+
+POLICIES = frozenset(['allow', 'deny', 'drop'])
+FIREWALL_PROTOCOLS = frozenset(['Tcp', 'Udp', 'Icmp', 'Any', 'Other'])
+LOAD_BALANCER_PROTOCOLS = frozenset(['HTTP', 'HTTPS', 'TCP'])
+ALGORITHMS = frozenset(['IP_HASH', 'ROUND_ROBIN', 'URI', 'LEAST_CONN'])
+WEIGHT_MAX = 100
+
+
+def _localname(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(element, tag):
+    child = getattr(element, tag, None)
+    if child is None:
+        return None
+    return child.text
+
+
+def _children(element, tag):
+    if not hasattr(element, tag):
+        return []
+    return getattr(element, tag)
+
+
+def _is_disabled(service_port):
+    return str(_text(service_port, 'IsEnabled')).lower() == 'false'
+
+
+class Validator(object):
+    """
+    Use the Validator to check staged firewall rules, pools and virtual
+    servers before they are committed. Every error is collected instead of
+    stopping at the first one, and each distinct address, range or port
+    value is parsed only once per Validator.
+    """
+    def __init__(self, pool_names=()):
+        self.pool_names = set(pool_names)
+        self.errors = []
+        self._parsed = {}
+
+    def _check(self, parser, value, label, field):
+        if value is None:
+            self.errors.append('{}: {} is missing.'.format(label, field))
+            return
+
+        key = (parser, value)
+        if key not in self._parsed:
+            try:
+                parser(value)
+                self._parsed[key] = True
+            except ValueError:
+                self._parsed[key] = False
+
+        if not self._parsed[key]:
+            self.errors.append(
+                '{}: {} {!r} is invalid.'.format(label, field, value))
+
+    def _check_choice(self, choices, value, label, field):
+        if value not in choices:
+            self.errors.append(
+                '{}: {} {!r} is not one of {}.'.format(
+                    label, field, value, ', '.join(sorted(choices))))
+
+    def validate(self, element):
+        """
+        Validate a FirewallRule, Pool, Member or VirtualServer element.
+
+        :param element: lxml ObjectifiedElement.
+        """
+        kind = _localname(element.tag)
+        if kind == 'FirewallRule':
+            self.validate_firewall_rule(element)
+        elif kind == 'Pool':
+            self.validate_pool(element)
+        elif kind == 'Member':
+            self.validate_member(element)
+        elif kind == 'VirtualServer':
+            self.validate_virtual_server(element)
+
+    def validate_firewall_rule(self, rule):
+        """
+        Validate the policy, protocols, IP ranges and ports of a firewall rule.
+
+        :param rule: FirewallRule as an ObjectifiedElement.
+        """
+        label = 'Firewall rule {!r}'.format(_text(rule, 'Description'))
+
+        policy = _text(rule, 'Policy')
+        self._check_choice(
+            POLICIES, policy and policy.lower(), label, 'Policy')
+
+        protocols = getattr(rule, 'Protocols', None)
+        names = [] if protocols is None else [
+            _localname(protocol.tag) for protocol in protocols.iterchildren()]
+        if not names:
+            self.errors.append('{}: Protocols is missing.'.format(label))
+        for name in names:
+            self._check_choice(FIREWALL_PROTOCOLS, name, label, 'Protocol')
+
+        self._check(parse_port_range, _text(rule, 'Port'), label, 'Port')
+        self._check(
+            parse_port_range, _text(rule, 'DestinationPortRange'), label,
+            'DestinationPortRange')
+        self._check(
+            parse_ip_range, _text(rule, 'DestinationIp'), label,
+            'DestinationIp')
+        self._check(
+            parse_port_range, _text(rule, 'SourcePort'), label, 'SourcePort')
+        self._check(
+            parse_port_range, _text(rule, 'SourcePortRange'), label,
+            'SourcePortRange')
+        self._check(parse_ip_range, _text(rule, 'SourceIp'), label, 'SourceIp')
+
+    def _validate_service_port(self, service_port, label):
+        self._check_choice(
+            LOAD_BALANCER_PROTOCOLS, _text(service_port, 'Protocol'), label,
+            'Protocol')
+        self._check(parse_port, _text(service_port, 'Port'), label, 'Port')
+
+        # An empty HealthCheckPort defaults to Port.
+        health_check_port = _text(service_port, 'HealthCheckPort')
+        if health_check_port:
+            self._check(
+                parse_port, health_check_port, label, 'HealthCheckPort')
+
+    def validate_pool(self, pool):
+        """
+        Validate the service ports and members of a pool. Disabled service
+        ports, which VCD includes with an empty Port, are skipped.
+
+        :param pool: Pool as an ObjectifiedElement.
+        """
+        label = 'Pool {!r}'.format(_text(pool, 'Name'))
+
+        service_ports = list(_children(pool, 'ServicePort'))
+        if not service_ports:
+            self.errors.append('{}: ServicePort is missing.'.format(label))
+        for service_port in service_ports:
+            if _is_disabled(service_port):
+                continue
+            self._validate_service_port(service_port, label)
+            algorithm = _text(service_port, 'Algorithm')
+            if algorithm is not None:
+                self._check_choice(ALGORITHMS, algorithm, label, 'Algorithm')
+
+        for member in _children(pool, 'Member'):
+            self.validate_member(member)
+
+    def validate_member(self, member):
+        """
+        Validate the IP, weight and service ports of a pool member. Member
+        service ports with the protocol of a disabled pool service port are
+        skipped.
+
+        :param member: Member as an ObjectifiedElement.
+        """
+        pool = member.getparent()
+        disabled = set()
+        if pool is not None:
+            disabled = set(
+                _text(service_port, 'Protocol')
+                for service_port in _children(pool, 'ServicePort')
+                if _is_disabled(service_port))
+
+        ip_address = _text(member, 'IpAddress')
+        label = 'Pool {!r} member {!r}'.format(
+            _text(pool, 'Name') if pool is not None else None, ip_address)
+        self._check(parse_ip, ip_address, label, 'IpAddress')
+
+        weight = _text(member, 'Weight')
+        if weight is not None and \
+                not (weight.isdigit() and int(weight) <= WEIGHT_MAX):
+            self.errors.append('{}: Weight {!r} is invalid.'.format(
+                label, weight))
+
+        for service_port in _children(member, 'ServicePort'):
+            if _is_disabled(service_port) or \
+                    _text(service_port, 'Protocol') in disabled:
+                continue
+            self._validate_service_port(service_port, label)
+
+    def validate_virtual_server(self, virtual_server):
+        """
+        Validate the IP, pool and service profiles of a virtual server.
+
+        :param virtual_server: VirtualServer as an ObjectifiedElement.
+        """
+        label = 'Virtual server {!r}'.format(_text(virtual_server, 'Name'))
+
+        self._check(
+            parse_ip, _text(virtual_server, 'IpAddress'), label, 'IpAddress')
+
+        pool = _text(virtual_server, 'Pool')
+        if pool not in self.pool_names:
+            self.errors.append(
+                '{}: Pool {!r} does not exist.'.format(label, pool))
+
+        service_profiles = list(_children(virtual_server, 'ServiceProfile'))
+        if not service_profiles:
+            self.errors.append('{}: ServiceProfile is missing.'.format(label))
+        for service_profile in service_profiles:
+            self._check_choice(
+                LOAD_BALANCER_PROTOCOLS, _text(service_profile, 'Protocol'),
+                label, 'Protocol')
+            self._check(
+                parse_port, _text(service_profile, 'Port'), label, 'Port')
@@ -11,5 +11,10 @@ setup(
         'requests',
         'lxml',
     ],
+    entry_points={
+        'console_scripts': [
+            'pyvcd = pyvcd.cli:main',
+        ],
+    },
 )
 
@@ -0,0 +1,266 @@
+from StringIO import StringIO
+import time
+
+import mock
+import nose.tools
+
+from pyvcd import cli, errors
+from pyvcd.client import VCloudClient
+from pyvcd.edge_gateway import EdgeGatewayDriver
+
+
+def test_read_records_csv():
+    stream = StringIO(
+        'gateway,kind,name,protocol,src_ip_range,dest_port_range,'
+        'dest_ip_range,policy\n'
+        'gw-one,firewall_rule,rule-one,TCP,Any,443,10.0.0.1,\n')
+    records = list(cli.read_records(stream, 'csv'))
+
+    assert records == [{
+        'gateway': 'gw-one',
+        'kind': 'firewall_rule',
+        'name': 'rule-one',
+        'protocol': 'TCP',
+        'src_ip_range': 'Any',
+        'dest_port_range': '443',
+        'dest_ip_range': '10.0.0.1',
+    }]
+
+
+def test_read_records_jsonl():
+    stream = StringIO(
+        '{"gateway": "gw-one", "kind": "pool"}\n'
+        '\n'
+        '{"gateway": "gw-two", "kind": "pool"}\n')
+    records = cli.read_records(stream)
+
+    assert next(records)['gateway'] == 'gw-one'
+    assert next(records)['gateway'] == 'gw-two'
+
+
+def test_read_records_jsonl_malformed():
+    stream = StringIO(
+        '{"gateway": "gw-one", "kind": "pool"}\n'
+        '{"gateway": "gw-two", \n'
+        '["gw-three"]\n'
+        '{"gateway": "gw-four", "kind": "pool"}\n')
+    messages = []
+    records = list(cli.read_records(stream, on_error=messages.append))
+
+    assert [record['gateway'] for record in records] == ['gw-one', 'gw-four']
+    assert messages == [
+        '<records>:2: malformed record', '<records>:3: malformed record']
+
+
+def test_stage_firewall_rule():
+    mock_driver = mock.create_autospec(EdgeGatewayDriver)
+    cli.stage(mock_driver, {
+        'gateway': 'gw-one',
+        'kind': 'firewall_rule',
+        'name': 'rule-one',
+        'protocol': 'TCP',
+        'src_ip_range': 'Any',
+        'dest_port_range': '443',
+        'dest_ip_range': '10.0.0.1',
+        'policy': 'deny',
+    })
+
+    mock_driver.add_firewall_rule.assert_called_once_with(
+        name='rule-one', protocol='TCP', src_ip_range='Any',
+        dest_port_range='443', dest_ip_range='10.0.0.1', policy='deny')
+
+
+def test_stage_pool():
+    mock_driver = mock.create_autospec(EdgeGatewayDriver)
+    cli.stage(mock_driver, {
+        'kind': 'pool',
+        'name': 'pool-one',
+        'service_ports': 'http:80',
+        'members': '10.0.0.1;10.0.0.2:8080:5',
+    })
+
+    args = mock_driver.add_pool.call_args[0]
+    assert args[0] == 'pool-one'
+    assert args[1][0].Protocol == 'HTTP'
+    assert args[1][0].Algorithm == 'ROUND_ROBIN'
+    assert [member.IpAddress for member in args[2]] == [
+        '10.0.0.1', '10.0.0.2']
+    assert args[2][0].ServicePort.Port.text == '80'
+    assert args[2][1].ServicePort.Port.text == '8080'
+    assert args[2][1].Weight.text == '5'
+
+
+def test_stage_virtual_server():
+    mock_driver = mock.create_autospec(EdgeGatewayDriver)
+    cli.stage(mock_driver, {
+        'kind': 'virtual_server',
+        'name': 'vs-one',
+        'ip_address': '10.0.0.1',
+        'pool_name': 'pool-one',
+        'network_name': 'network-one',
+        'service_profiles': ['http:80', 'https:443'],
+    })
+
+    args = mock_driver.add_virtual_server.call_args[0]
+    assert args[:4] == ('vs-one', '10.0.0.1', 'pool-one', 'network-one')
+    assert [profile.Port.text for profile in args[4]] == ['80', '443']
+
+
+def test_stage_unknown():
+    mock_driver = mock.create_autospec(EdgeGatewayDriver)
+
+    with nose.tools.assert_raises(ValueError):
+        cli.stage(mock_driver, {'kind': 'test-kind'})
+
+
+@mock.patch('pyvcd.cli.stage', autospec=True)
+@mock.patch('pyvcd.cli.EdgeGatewayDriver', autospec=True)
+def test_bulk_applier(mock_driver_class, mock_stage):
+    staged = []
+    mock_stage.side_effect = \
+        lambda driver, record: staged.append(record['name'])
+
+    records = [
+        {'gateway': 'gw-{}'.format(index % 3), 'name': index}
+        for index in xrange(20)
+    ]
+    out = StringIO()
+    applier = cli.BulkApplier(
+        mock.create_autospec(VCloudClient), parallel=2, batch_size=3,
+        out=out)
+    stats = applier.apply(iter(records))
+    applier.summary()
+
+    assert sorted(stats) == ['gw-0', 'gw-1', 'gw-2']
+    assert stats['gw-0'].items == 7
+    assert stats['gw-0'].batches == 3
+    assert stats['gw-0'].first_latency is not None
+    assert stats['gw-0'].last_latency is not None
+    assert sum(item.failures for item in stats.values()) == 0
+
+    # Each gateway is loaded once and its records are staged in order.
+    assert mock_driver_class.call_count == 3
+    for gateway in xrange(3):
+        assert [name for name in staged if name % 3 == gateway] == \
+            range(gateway, 20, 3)
+
+    assert 'gw-0: 7 items in 3 batches' in out.getvalue()
+
+
+@mock.patch('pyvcd.cli.stage', autospec=True)
+@mock.patch('pyvcd.cli.EdgeGatewayDriver', autospec=True)
+def test_bulk_applier_failure(mock_driver_class, mock_stage):
+    mock_driver_class.return_value.commit.side_effect = [
+        Exception('test-error'), None]
+
+    records = [{'gateway': 'gw-one', 'name': index} for index in xrange(4)]
+    applier = cli.BulkApplier(
+        mock.create_autospec(VCloudClient), parallel=1, batch_size=2,
+        out=StringIO())
+    stats = applier.apply(records)
+
+    assert stats['gw-one'].failures == 1
+    assert stats['gw-one'].items == 2
+
+    # The gateway is loaded again after a failed batch.
+    assert mock_driver_class.return_value.load.call_count == 2
+
+
+@mock.patch('pyvcd.cli.stage', autospec=True)
+@mock.patch('pyvcd.cli.EdgeGatewayDriver', autospec=True)
+def test_bulk_applier_skipped(mock_driver_class, mock_stage):
+    records = [{'gateway': 'gw-one', 'name': 0}, {'name': 1}]
+    out = StringIO()
+    applier = cli.BulkApplier(
+        mock.create_autospec(VCloudClient), parallel=1, out=out)
+    stats = applier.apply(records)
+    applier.summary()
+
+    assert stats['gw-one'].items == 1
+    assert applier.skipped == 1
+    assert "skipped record without gateway: {'name': 1}" in out.getvalue()
+    assert '1 skipped records' in out.getvalue()
+
+
+@mock.patch('pyvcd.cli.EdgeGatewayDriver', autospec=True)
+def test_bulk_applier_bad_record(mock_driver_class):
+    mock_driver = mock_driver_class.return_value
+    mock_driver.add_firewall_rule.side_effect = [
+        None, errors.VCloudResourceConflict('test-error'), None]
+
+    rule = {
+        'gateway': 'gw-one', 'kind': 'firewall_rule', 'protocol': 'TCP',
+        'src_ip_range': 'Any', 'dest_port_range': '443',
+        'dest_ip_range': '10.0.0.1'}
+    records = [
+        dict(rule, name='rule-one'),
+        {'gateway': 'gw-one', 'kind': 'test-kind', 'name': 'unknown'},
+        {'gateway': 'gw-one', 'kind': 'pool', 'name': 'missing-fields'},
+        dict(rule, name='rule-two'),
+        dict(rule, name='rule-three'),
+    ]
+    out = StringIO()
+    applier = cli.BulkApplier(
+        mock.create_autospec(VCloudClient), parallel=1, batch_size=10,
+        out=out)
+    stats = applier.apply(records)
+
+    # Bad records are skipped, the rest of the batch is committed.
+    assert mock_driver.commit.call_count == 1
+    assert stats['gw-one'].items == 2
+    assert stats['gw-one'].failures == 0
+    assert applier.skipped == 3
+    assert "'name': 'unknown'" in out.getvalue()
+    assert "'name': 'rule-two'" in out.getvalue()
+
+
+@mock.patch('pyvcd.cli.stage', autospec=True)
+@mock.patch('pyvcd.cli.EdgeGatewayDriver', autospec=True)
+def test_bulk_applier_records_error(mock_driver_class, mock_stage):
+    committed = []
+    mock_driver_class.return_value.commit.side_effect = \
+        lambda: time.sleep(0.1) or committed.append(True)
+
+    def records():
+        for index in xrange(4):
+            yield {'gateway': 'gw-{}'.format(index), 'name': index}
+        raise IOError('test-error')
+
+    applier = cli.BulkApplier(
+        mock.create_autospec(VCloudClient), parallel=2, batch_size=1,
+        out=StringIO())
+    with nose.tools.assert_raises(IOError):
+        applier.apply(records())
+
+    # Submitted batches are committed before the error is raised.
+    assert len(committed) == 4
+    assert sum(stats.items for stats in applier.stats.values()) == 4
+
+
+def test_bulk_applier_parallel():
+    with nose.tools.assert_raises(ValueError):
+        cli.BulkApplier(mock.create_autospec(VCloudClient), parallel=0)
+
+    with mock.patch('sys.stderr', StringIO()), \
+            nose.tools.assert_raises(SystemExit):
+        cli.parse_args([
+            '--host', 'test-host', '--org', 'test-org', '--user', 'test-user',
+            '--parallel', '0'])
+
+
+@mock.patch.dict('os.environ', {'PYVCD_PASSWORD': 'test-pass'})
+@mock.patch('pyvcd.cli.BulkApplier', autospec=True)
+@mock.patch('pyvcd.cli.VCloudClient', autospec=True)
+def test_main(mock_client_class, mock_applier_class):
+    mock_applier_class.return_value.apply.return_value = {}
+    mock_applier_class.return_value.skipped = 0
+
+    assert cli.main([
+        '--host', 'test-host', '--org', 'test-org', '--user', 'test-user',
+        '--parallel', '8', '--batch-size', '50', 'test.csv']) == 0
+
+    mock_client_class.assert_called_once_with('test-host', '5.1', 'test-org')
+    mock_client_class.return_value.authenticate.assert_called_once_with(
+        'test-user', 'test-pass')
+    mock_applier_class.assert_called_once_with(
+        mock_client_class.return_value, 8, 50)
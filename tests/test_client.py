@@ -1,3 +1,7 @@
+from StringIO import StringIO
+import threading
+from time import sleep
+
 from lxml import etree, objectify
 import mock
 import nose.tools
@@ -5,6 +9,7 @@ import requests
 
 from pyvcd import errors
 from pyvcd.client import VCloudClient
+from pyvcd.tasks import NotificationTaskSource
 
 
 HOST = 'test-host'
@@ -23,14 +28,14 @@ def test_init():
     assert not client.auth_token
 
 
-@mock.patch('requests.request', autospec=True)
+@mock.patch('requests.Session.request', autospec=True)
 def test_request_no_auth_token(mock_request):
     client = VCloudClient(HOST, VERSION, ORG)
     with nose.tools.assert_raises(errors.VCloudAuthError):
         client.request('test-method', 'test-url')
 
 
-@mock.patch('requests.request', autospec=True)
+@mock.patch('requests.Session.request', autospec=True)
 def test_request(mock_request):
     mock_response = mock.create_autospec(requests.Response)
     mock_response.status_code = 200
@@ -42,7 +47,7 @@ def test_request(mock_request):
         'test-method', 'test-url', headers={'test-header': 'test'})
 
 
-@mock.patch('requests.request', autospec=True)
+@mock.patch('requests.Session.request', autospec=True)
 def test_request_failure(mock_request):
     mock_response = mock.create_autospec(requests.Response)
     mock_response.status_code = 400
@@ -61,7 +66,7 @@ def test_url():
     assert client.url(path) == 'https://{}/api/{}'.format(HOST, path)
 
 
-@mock.patch('requests.request', autospec=True)
+@mock.patch('requests.Session.request', autospec=True)
 def test_authenticate(mock_request):
     mock_response = mock.create_autospec(requests.Response)
     mock_response.status_code = 200
@@ -76,7 +81,7 @@ def test_authenticate(mock_request):
     assert client.auth_token == 'test-token'
 
 
-@mock.patch('requests.request', autospec=True)
+@mock.patch('requests.Session.request', autospec=True)
 def test_authenticate_failure(mock_request):
     mock_response = mock.create_autospec(requests.Response)
     mock_response.status_code = 400
@@ -88,7 +93,7 @@ def test_authenticate_failure(mock_request):
         client.authenticate('test-user', 'test-pass')
 
 
-@mock.patch('requests.request', autospec=True)
+@mock.patch('requests.Session.request', autospec=True)
 def test_wait_for_task_timeout(mock_request):
     mock_task = objectify.Element('Task')
     mock_task.attrib['operation'] = 'test-operation'
@@ -106,7 +111,7 @@ def test_wait_for_task_timeout(mock_request):
         client.wait_for_task('test-task-url', 2, 0)
 
 
-@mock.patch('requests.request', autospec=True)
+@mock.patch('requests.Session.request', autospec=True)
 def test_wait_for_task_success(mock_request):
     mock_task = objectify.Element('Task')
     mock_task.attrib['operation'] = 'test-operation'
@@ -123,7 +128,7 @@ def test_wait_for_task_success(mock_request):
     assert not client.wait_for_task('test-task-url', 2, 0)
 
 
-@mock.patch('requests.request', autospec=True)
+@mock.patch('requests.Session.request', autospec=True)
 def test_wait_for_task_failure(mock_request):
     mock_task = objectify.Element('Task')
     mock_task.attrib['operation'] = 'test-operation'
@@ -139,3 +144,177 @@ def test_wait_for_task_failure(mock_request):
 
     with nose.tools.assert_raises(errors.VCloudAPIError):
         client.wait_for_task('test-task-url', 2, 0)
+
+
+@mock.patch('requests.Session.request', autospec=True)
+def test_wait_for_task_source(mock_request):
+    mock_task_source = mock.create_autospec(NotificationTaskSource)
+    mock_task_source.wait.return_value = 'success'
+
+    client = VCloudClient(HOST, VERSION, ORG)
+    client.auth_token = 'test-token'
+    client.task_source = mock_task_source
+
+    assert not client.wait_for_task('test-task-url', 2, 0)
+    mock_task_source.wait.assert_called_once_with('test-task-url')
+    assert not mock_request.called
+
+
+@mock.patch('requests.Session.request', autospec=True)
+def test_wait_for_task_source_failure(mock_request):
+    mock_task_source = mock.create_autospec(NotificationTaskSource)
+    mock_task_source.wait.return_value = 'error'
+
+    client = VCloudClient(HOST, VERSION, ORG)
+    client.auth_token = 'test-token'
+    client.task_source = mock_task_source
+
+    with nose.tools.assert_raises(errors.VCloudAPIError):
+        client.wait_for_task('test-task-url', 2, 0)
+    assert not mock_request.called
+
+
+@mock.patch('requests.Session.request', autospec=True)
+def test_wait_for_task_source_deadline(mock_request):
+    mock_task = objectify.Element('Task')
+    mock_task.attrib['operation'] = 'test-operation'
+    mock_task.attrib['status'] = 'success'
+
+    mock_response = mock.create_autospec(requests.Response)
+    mock_response.status_code = 200
+    mock_response.content = etree.tostring(mock_task)
+    mock_request.return_value = mock_response
+
+    mock_task_source = mock.create_autospec(NotificationTaskSource)
+    mock_task_source.wait.return_value = None
+
+    client = VCloudClient(HOST, VERSION, ORG)
+    client.auth_token = 'test-token'
+    client.task_source = mock_task_source
+
+    # No event before the deadline, fall back to polling.
+    assert not client.wait_for_task('test-task-url', 2, 0)
+    assert mock_request.call_count == 1
+
+
+@mock.patch('requests.Session.request', autospec=True)
+def test_request_file_data(mock_request):
+    mock_response = mock.create_autospec(requests.Response)
+    mock_response.status_code = 200
+    mock_request.return_value = mock_response
+
+    client = VCloudClient(HOST, VERSION, ORG)
+    client.auth_token = 'test-token'
+    client.request('test-method', 'test-url', data=StringIO('x' * 100000))
+
+    # File-like data is passed on as a generator of chunks.
+    data = mock_request.call_args[1]['data']
+    assert not isinstance(data, basestring)
+    assert ''.join(data) == 'x' * 100000
+
+
+class FakeSessionServer(object):
+    """
+    Transport that accepts one auth token at a time and issues a new one
+    on each login.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.token = 'token-0'
+        self.requests = 0
+
+    def expire(self):
+        with self.lock:
+            self.token = 'expired'
+
+    def request(self, method, url, headers=None, data=None, auth=None):
+        mock_response = mock.Mock()
+        with self.lock:
+            if method == 'post' and url.endswith('/sessions'):
+                self.logins += 1
+                self.token = 'token-{}'.format(self.logins)
+                mock_response.status_code = 200
+                mock_response.headers = {
+                    'x-vcloud-authorization': self.token}
+            elif headers['x-vcloud-authorization'] == self.token:
+                self.requests += 1
+                mock_response.status_code = 200
+            else:
+                mock_response.status_code = 401
+        # Widen the window in which other threads see the 401.
+        sleep(0.001)
+        return mock_response
+
+
+def test_request_refresh():
+    server = FakeSessionServer()
+    client = VCloudClient(HOST, VERSION, ORG, server)
+    client.authenticate('test-user', 'test-pass')
+    headers = client._auth[1]
+
+    server.expire()
+    assert client.request('GET', 'test-url')
+    assert server.logins == 2
+    assert client.auth_token == 'token-2'
+
+    # Headers are rebuilt, never modified.
+    assert headers['x-vcloud-authorization'] == 'token-1'
+    assert 'x-vcloud-authorization' not in client.default_headers
+
+
+def test_request_refresh_stream():
+    server = FakeSessionServer()
+    client = VCloudClient(HOST, VERSION, ORG, server)
+    client.authenticate('test-user', 'test-pass')
+
+    # Streamed data can't be sent again, but the token is refreshed.
+    server.expire()
+    with nose.tools.assert_raises(errors.VCloudAPIError):
+        client.request('POST', 'test-url', data=iter(['test-data']))
+    assert client.request('GET', 'test-url')
+    assert server.logins == 2
+
+
+def test_request_refresh_without_credentials():
+    server = FakeSessionServer()
+    client = VCloudClient(HOST, VERSION, ORG, server)
+    client.auth_token = 'token-0'
+
+    server.expire()
+    with nose.tools.assert_raises(errors.VCloudAPIError):
+        client.request('GET', 'test-url')
+    assert server.logins == 0
+
+
+def test_request_refresh_threads():
+    server = FakeSessionServer()
+    client = VCloudClient(HOST, VERSION, ORG, server)
+    client.authenticate('test-user', 'test-pass')
+    server.expire()
+
+    thread_count = 128
+    request_count = 10
+    start = threading.Event()
+    failures = []
+
+    def work():
+        start.wait()
+        for _ in xrange(request_count):
+            try:
+                client.request(
+                    'GET', 'test-url', headers={'test-header': 'test'})
+            except Exception as e:
+                failures.append(e)
+
+    threads = [threading.Thread(target=work) for _ in xrange(thread_count)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+
+    # All threads got a 401 on the first request, but only one logged in.
+    assert failures == []
+    assert server.logins == 2
+    assert server.requests == thread_count * request_count
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from lxml import etree, objectify
 import mock
 import nose.tools
@@ -31,6 +33,11 @@ def edge_gateway():
     return mock_edge_gateway
 
 
+def canonical(xml):
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.tostring(etree.fromstring(xml, parser), method='c14n')
+
+
 def get_mock_client(
         query_status=200, edge_gateway_status=200, task_status=200):
     mock_query_response = mock.create_autospec(requests.Response)
@@ -242,3 +249,415 @@ def test_commit_failure():
     driver.load()
     with nose.tools.assert_raises(errors.VCloudAPIError):
         driver.commit()
+
+
+def test_add_firewall_rule_overlap():
+    mock_client = get_mock_client()
+
+    driver = EdgeGatewayDriver(mock_client, 'test-name')
+    driver.load()
+
+    driver.add_firewall_rule(
+        'test-rule-one', 'TCP', 'any', '80-90', '10.0.0.0/24')
+
+    # Overlapping rules are allowed unless checked.
+    driver.add_firewall_rule(
+        'test-rule-two', 'TCP', 'any', 85, '10.0.0.5')
+
+    with nose.tools.assert_raises(errors.VCloudResourceConflict):
+        driver.add_firewall_rule(
+            'test-rule-three', 'TCP', 'any', 90, '10.0.0.1-10.0.0.9',
+            check_overlap=True)
+
+    driver.add_firewall_rule(
+        'test-rule-four', 'UDP', 'any', 90, '10.0.0.1-10.0.0.9',
+        check_overlap=True)
+    driver.add_firewall_rule(
+        'test-rule-five', 'TCP', 'any', 91, '10.0.0.1-10.0.0.9',
+        check_overlap=True)
+
+    # Rules added after the index is built are indexed.
+    with nose.tools.assert_raises(errors.VCloudResourceConflict):
+        driver.add_firewall_rule(
+            'test-rule-six', 'TCP', 'any', 'any', '10.0.0.0/8',
+            check_overlap=True)
+    assert len(driver.conflict_index().overlapping_firewall_rules(
+        'any', '10.0.0.3', 91)) == 1
+
+
+def test_add_firewall_rule_overlap_invalid():
+    driver = EdgeGatewayDriver(get_mock_client(), 'test-name')
+    driver.load()
+
+    with nose.tools.assert_raises(errors.VCloudValidationError) as context:
+        driver.add_firewall_rule(
+            'test-rule-one', 'TCP', 'any', 80, '10.0.0', check_overlap=True)
+    assert context.exception.args[1] == [
+        "Firewall rule 'test-rule-one': Invalid IP address. '10.0.0'"]
+
+    with nose.tools.assert_raises(errors.VCloudValidationError):
+        driver.add_firewall_rule(
+            'test-rule-two', 'TCP', 'any', '90-80', 'any', check_overlap=True)
+
+    # Nothing is staged.
+    assert driver._staged == []
+
+
+@mock.patch(
+    'pyvcd.edge_gateway.NetworkDriver.get_network_by_name', autospec=True)
+def test_add_virtual_server_overlap(mock_get_network):
+    mock_network = objectify.Element('NetworkRecord')
+    mock_network.attrib['name'] = 'test-network'
+    mock_network.attrib['href'] = 'test-network-href'
+    mock_get_network.return_value = mock_network
+    mock_client = get_mock_client()
+
+    driver = EdgeGatewayDriver(mock_client, 'test-name')
+    driver.load()
+
+    mock_service_profile = objectify.Element('ServiceProfile')
+
+    driver.add_virtual_server(
+        'test-vs-one', '10.0.0.1', 'test-pool', 'test-network',
+        [mock_service_profile], check_overlap=True)
+
+    # Same address, different string.
+    with nose.tools.assert_raises(errors.VCloudResourceConflict):
+        driver.add_virtual_server(
+            'test-vs-two', ' 10.0.0.1', 'test-pool', 'test-network',
+            [mock_service_profile], check_overlap=True)
+
+    with nose.tools.assert_raises(errors.VCloudValidationError):
+        driver.add_virtual_server(
+            'test-vs-three', '10.0.0', 'test-pool', 'test-network',
+            [mock_service_profile], check_overlap=True)
+
+
+def test_iter_xml():
+    mock_client = get_mock_client()
+
+    driver = EdgeGatewayDriver(mock_client, 'test-name')
+    driver.load()
+    driver.add_firewall_rule('test-rule-one', 'TCP', 'any', 80, 'any')
+    driver.add_pool(
+        'test-pool-one', [objectify.Element('ServicePort')],
+        [objectify.Element('Member')])
+
+    driver.add_firewall_rule('test-rule-two', 'TCP', 'any', 443, 'any')
+
+    chunks = list(driver.iter_xml())
+
+    # One chunk per service child plus the closing tags.
+    assert len(chunks) == 6
+    assert max(chunk.count('<FirewallRule') for chunk in chunks) == 1
+    assert canonical(''.join(chunks)) == canonical(driver.to_xml())
+
+
+def test_iter_xml_namespace():
+    driver = EdgeGatewayDriver(mock.create_autospec(VCloudClient), 'test')
+    driver.edge_gateway = objectify.fromstring(
+        '<EdgeGateway xmlns="http://www.vmware.com/vcloud/v1.5">'
+        '<Configuration><EdgeGatewayServiceConfiguration>'
+        '<FirewallService><IsEnabled>true</IsEnabled></FirewallService>'
+        '</EdgeGatewayServiceConfiguration></Configuration></EdgeGateway>')
+    driver.config = \
+        driver.edge_gateway.Configuration.EdgeGatewayServiceConfiguration
+    driver.add_firewall_rule('test-rule-one', 'TCP', 'any', 80, 'any')
+
+    assert canonical(''.join(driver.iter_xml())) == \
+        canonical(driver.to_xml())
+
+
+def test_commit_stream():
+    mock_client = get_mock_client()
+    mock_client.wait_for_task.return_value = True
+
+    driver = EdgeGatewayDriver(mock_client, 'test-name')
+    driver.load()
+    driver.add_firewall_rule('test-rule-one', 'TCP', 'any', 80, 'any')
+    expected = driver.to_xml()
+    driver.commit(stream=True)
+
+    data = mock_client.request.call_args[1]['data']
+    assert not isinstance(data, basestring)
+    assert canonical(''.join(data)) == canonical(expected)
+
+
+def test_commit_validation_failure():
+    mock_client = get_mock_client()
+
+    driver = EdgeGatewayDriver(mock_client, 'test-name')
+    driver.load()
+    driver.add_firewall_rule('test-rule-one', 'TCP', 'any', 80, '10.0.0')
+    driver.add_firewall_rule('test-rule-two', 'FTP', 'any', 80, 'any')
+
+    with nose.tools.assert_raises(errors.VCloudValidationError) as context:
+        driver.commit()
+
+    assert len(context.exception.args[1]) == 2
+
+    # Nothing is sent to VCD.
+    assert mock_client.request.call_count == 2
+    assert not mock_client.wait_for_task.called
+
+
+def test_commit_validation_staged_only():
+    mock_client = get_mock_client()
+    mock_client.wait_for_task.return_value = True
+
+    driver = EdgeGatewayDriver(mock_client, 'test-name')
+    driver.load()
+
+    # Existing configuration is not validated.
+    existing_rule = objectify.Element('FirewallRule')
+    existing_rule.Description = 'test-existing-rule'
+    existing_rule.DestinationIp = 'not-an-ip'
+    driver.add_service('FirewallService').append(existing_rule)
+    driver.add_firewall_rule('test-rule-one', 'TCP', 'any', 80, 'any')
+    driver.commit()
+
+    assert driver._staged == []
+
+
+PROTOCOLS = ('HTTP', 'HTTPS', 'TCP')
+
+
+def member(ip_address, port=80, weight=None, protocol='HTTP'):
+    # VCD members list every protocol, with an empty Port unless it is used.
+    mock_member = objectify.Element('Member')
+    mock_member.IpAddress = ip_address
+    if weight is not None:
+        mock_member.Weight = weight
+    for member_protocol in PROTOCOLS:
+        mock_service_port = objectify.Element('ServicePort')
+        mock_service_port.Protocol = member_protocol
+        mock_service_port.Port = port if member_protocol == protocol else ''
+        mock_member.append(mock_service_port)
+    return mock_member
+
+
+def service_ports(enabled_protocol='HTTP'):
+    # VCD pools include every protocol, disabled ones with an empty Port.
+    mock_service_ports = []
+    for protocol, port in [('HTTP', '80'), ('HTTPS', '443'), ('TCP', '')]:
+        mock_service_port = objectify.Element('ServicePort')
+        mock_service_port.IsEnabled = \
+            'true' if protocol == enabled_protocol else 'false'
+        mock_service_port.Protocol = protocol
+        mock_service_port.Algorithm = 'ROUND_ROBIN'
+        mock_service_port.Port = port
+        mock_service_port.HealthCheckPort = ''
+        mock_service_ports.append(mock_service_port)
+
+    return mock_service_ports
+
+
+def get_pool_driver(mock_client=None):
+    driver = EdgeGatewayDriver(mock_client or get_mock_client(), 'test-name')
+    driver.load()
+
+    driver.add_pool('test-pool-one', service_ports(), [
+        member('10.0.0.1', weight=1),
+        member('10.0.0.2', weight=1),
+        member('10.0.0.2', 8080, weight=1),
+    ])
+    driver.add_pool('test-pool-two', service_ports(), [
+        member('10.0.0.1', weight=1),
+    ])
+
+    return driver
+
+
+def member_keys(pool):
+    return [
+        (m.IpAddress.text,
+         [service_port.Port.text for service_port in m.ServicePort
+          if service_port.Port.text][0])
+        for m in pool.Member]
+
+
+def test_update_pool_members():
+    driver = get_pool_driver()
+    pool = driver.config.LoadBalancerService.Pool[0]
+
+    driver.update_pool_members(
+        'test-pool-one',
+        add=[member('10.0.0.3', weight=1), member('10.0.0.2', 9090)],
+        remove=['10.0.0.1', ('10.0.0.1', 80), ('10.0.0.2', 8080)],
+        weights={('10.0.0.2', 80): 5})
+
+    assert member_keys(pool) == [
+        ('10.0.0.2', '80'), ('10.0.0.3', '80'), ('10.0.0.2', '9090')]
+    assert pool.Member[0].Weight == 5
+
+    # Weight is kept right after IpAddress when it is added.
+    driver.update_pool_members('test-pool-one', weights={'10.0.0.2': 3})
+    assert pool.Member[2].Weight == 3
+    assert [child.tag for child in pool.Member[2].iterchildren()] == [
+        'IpAddress', 'Weight', 'ServicePort', 'ServicePort', 'ServicePort']
+
+    # Members can be added back after they are removed.
+    driver.update_pool_members(
+        'test-pool-one', add=[member('10.0.0.1')], remove=['10.0.0.3'])
+    assert member_keys(pool) == [
+        ('10.0.0.2', '80'), ('10.0.0.2', '9090'), ('10.0.0.1', '80')]
+
+    # The other pool is untouched.
+    assert member_keys(driver.config.LoadBalancerService.Pool[1]) == [
+        ('10.0.0.1', '80')]
+
+
+def test_update_pool_members_enabled_protocol():
+    driver = EdgeGatewayDriver(get_mock_client(), 'test-name')
+    driver.load()
+    driver.add_pool('test-pool-https', service_ports('HTTPS'), [
+        member('10.0.0.1', 443, protocol='HTTPS'),
+        member('10.0.0.1', 8443, protocol='HTTPS'),
+        member('10.0.0.2', 443, protocol='HTTPS'),
+    ])
+    pool = driver.config.LoadBalancerService.Pool
+
+    # Members are keyed by the port of the enabled HTTPS protocol, not the
+    # empty port of the first, disabled, HTTP protocol.
+    driver.update_pool_members('test-pool-https', remove=[('10.0.0.1', 8443)])
+    assert member_keys(pool) == [('10.0.0.1', '443'), ('10.0.0.2', '443')]
+
+    with nose.tools.assert_raises(errors.VCloudResourceConflict):
+        driver.update_pool_members(
+            'test-pool-https',
+            add=[member('10.0.0.2', 443, protocol='HTTPS')])
+
+    driver.update_pool_members(
+        'test-pool-https',
+        add=[member('10.0.0.1', 8443, protocol='HTTPS')])
+    driver.update_pool_members('test-pool-https', remove=['10.0.0.1'])
+    assert member_keys(pool) == [('10.0.0.2', '443')]
+    driver.validate()
+
+
+def test_update_pool_members_duplicates():
+    driver = EdgeGatewayDriver(get_mock_client(), 'test-name')
+    driver.load()
+    driver.add_pool('test-pool-one', service_ports(), [
+        member('10.0.0.1'), member('10.0.0.1'), member('10.0.0.2')])
+    pool = driver.config.LoadBalancerService.Pool
+
+    # Members with the same ip and port are updated together.
+    driver.update_pool_members('test-pool-one', weights={'10.0.0.1': 4})
+    assert [m.Weight for m in pool.Member[:2]] == [4, 4]
+    driver.update_pool_members('test-pool-one', remove=[('10.0.0.1', 80)])
+    assert member_keys(pool) == [('10.0.0.2', '80')]
+
+
+def test_update_pool_members_failure():
+    driver = get_pool_driver()
+    pool = driver.config.LoadBalancerService.Pool[0]
+
+    with nose.tools.assert_raises(errors.VCloudNotFoundError):
+        driver.update_pool_members('test-pool-three', remove=['10.0.0.1'])
+
+    with nose.tools.assert_raises(errors.VCloudNotFoundError):
+        driver.update_pool_members(
+            'test-pool-one', remove=['10.0.0.1', '10.0.0.9'])
+
+    with nose.tools.assert_raises(errors.VCloudNotFoundError):
+        driver.update_pool_members(
+            'test-pool-one', weights={('10.0.0.2', 9090): 1})
+
+    with nose.tools.assert_raises(errors.VCloudResourceConflict):
+        driver.update_pool_members(
+            'test-pool-one', add=[member('10.0.0.2', 8080)])
+
+    with nose.tools.assert_raises(errors.VCloudResourceConflict):
+        driver.update_pool_members(
+            'test-pool-one', add=[member('10.0.0.4'), member('10.0.0.4')])
+
+    # Failed updates change nothing.
+    assert member_keys(pool) == [
+        ('10.0.0.1', '80'), ('10.0.0.2', '80'), ('10.0.0.2', '8080')]
+
+
+def test_update_pools_members():
+    driver = get_pool_driver()
+
+    driver.update_pools_members({
+        'test-pool-one': {'remove': ['10.0.0.2']},
+        'test-pool-two': {'add': [member('10.0.0.5')]},
+    })
+
+    assert member_keys(driver.config.LoadBalancerService.Pool[0]) == [
+        ('10.0.0.1', '80')]
+    assert member_keys(driver.config.LoadBalancerService.Pool[1]) == [
+        ('10.0.0.1', '80'), ('10.0.0.5', '80')]
+
+    # Nothing changes if any pool is missing.
+    with nose.tools.assert_raises(errors.VCloudNotFoundError):
+        driver.update_pools_members({
+            'test-pool-one': {'remove': ['10.0.0.1']},
+            'test-pool-three': {'remove': ['10.0.0.1']},
+        })
+    assert member_keys(driver.config.LoadBalancerService.Pool[0]) == [
+        ('10.0.0.1', '80')]
+
+    # Nothing changes if a member of any pool is missing.
+    for update, error in [
+            ({'remove': ['10.0.0.9']}, errors.VCloudNotFoundError),
+            ({'weights': {('10.0.0.1', 8080): 2}}, errors.VCloudNotFoundError),
+            ({'add': [member('10.0.0.5')]}, errors.VCloudResourceConflict)]:
+        with nose.tools.assert_raises(error):
+            driver.update_pools_members(OrderedDict([
+                ('test-pool-one', {'add': [member('10.0.0.6')]}),
+                ('test-pool-two', update),
+            ]))
+        assert member_keys(driver.config.LoadBalancerService.Pool[0]) == [
+            ('10.0.0.1', '80')]
+        assert member_keys(driver.config.LoadBalancerService.Pool[1]) == [
+            ('10.0.0.1', '80'), ('10.0.0.5', '80')]
+
+
+def test_commit_changed_only():
+    mock_client = get_mock_client()
+    mock_client.wait_for_task.return_value = True
+
+    driver = get_pool_driver(mock_client)
+    driver.add_firewall_rule('test-rule-one', 'TCP', 'any', 80, 'any')
+    driver.commit()
+
+    # Nothing changed, nothing is sent.
+    driver.commit(changed_only=True)
+    assert mock_client.request.call_count == 3
+
+    # Only the load balancer service is sent.
+    mock_task_response = list(get_mock_client().request.side_effect)[-1]
+    mock_client.request.side_effect = [mock_task_response]
+    driver.update_pool_members(
+        'test-pool-one', add=[member('10.0.0.3')], remove=['10.0.0.1'],
+        weights={'10.0.0.2': 2})
+    driver.commit(changed_only=True)
+
+    data = mock_client.request.call_args[1]['data']
+    config = objectify.fromstring(data)
+    assert not hasattr(config, 'FirewallService')
+    assert len(config.LoadBalancerService.Pool[0].Member) == 3
+
+
+def test_update_pool_members_validation():
+    driver = get_pool_driver()
+    driver._staged = []
+
+    # Only the added and reweighted members are validated.
+    existing_member = driver.config.LoadBalancerService.Pool[0].Member[0]
+    existing_member.Weight = 500
+    driver.update_pool_members(
+        'test-pool-one', add=[member('10.0.0.300')], weights={'10.0.0.2': 3})
+    assert len(driver._staged) == 3
+
+    with nose.tools.assert_raises(errors.VCloudValidationError) as context:
+        driver.validate()
+    assert context.exception.args[1] == [
+        "Pool 'test-pool-one' member '10.0.0.300': "
+        "IpAddress '10.0.0.300' is invalid."]
+
+    # Removed members are no longer validated.
+    driver.update_pool_members('test-pool-one', remove=['10.0.0.300'])
+    driver.validate()
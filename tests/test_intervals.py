@@ -0,0 +1,97 @@
+from lxml import objectify
+import nose.tools
+
+from pyvcd.intervals import (
+    ConflictIndex, IntervalTree, parse_ip_range, parse_port_range)
+
+
+def firewall_rule(name, src_ip, dest_ip, dest_port, protocol='Tcp'):
+    rule = objectify.Element('FirewallRule')
+    rule.Description = name
+    rule.Protocols = objectify.Element('Protocols')
+    rule.Protocols[protocol] = 'true'
+    rule.DestinationPortRange = dest_port
+    rule.DestinationIp = dest_ip
+    rule.SourceIp = src_ip
+    return rule
+
+
+def virtual_server(name, ip_address):
+    element = objectify.Element('VirtualServer')
+    element.Name = name
+    element.IpAddress = ip_address
+    return element
+
+
+def test_parse_ip_range():
+    assert parse_ip_range('Any') == (0, 2 ** 32 - 1)
+    assert parse_ip_range('internal') == (0, 2 ** 32 - 1)
+    assert parse_ip_range('10.0.0.1') == (167772161, 167772161)
+    assert parse_ip_range('10.0.0.1-10.0.0.9') == (167772161, 167772169)
+    assert parse_ip_range('10.0.0.7/30') == (167772164, 167772167)
+
+
+def test_parse_ip_range_failure():
+    for value in ('10.0.0', '10.0.0.256', '10.0.0.9-10.0.0.1', '10.0.0.0/33'):
+        with nose.tools.assert_raises(ValueError):
+            parse_ip_range(value)
+
+
+def test_parse_port_range():
+    assert parse_port_range('Any') == (0, 65535)
+    assert parse_port_range(-1) == (0, 65535)
+    assert parse_port_range(80) == (80, 80)
+    assert parse_port_range('8000-8080') == (8000, 8080)
+
+
+def test_parse_port_range_failure():
+    for value in ('http', '65536', '90-80', '-5'):
+        with nose.tools.assert_raises(ValueError):
+            parse_port_range(value)
+
+
+def test_interval_tree():
+    tree = IntervalTree()
+    for low in xrange(0, 1000, 10):
+        tree.add(low, low + 14, low)
+
+    assert len(tree) == 100
+    assert sorted(tree.overlap(15, 25)) == [10, 20]
+    assert sorted(tree.overlap(9, 9)) == [0]
+    assert tree.overlap(1014, 2000) == []
+    assert len(tree.overlap(0, 2000)) == 100
+
+
+def test_overlapping_firewall_rules():
+    index = ConflictIndex()
+    index.add_firewall_rule(
+        firewall_rule('rule-one', 'Any', '10.0.0.0/24', '80-90'))
+    index.add_firewall_rule(
+        firewall_rule('rule-two', '192.168.0.1', '10.0.1.5', 'Any', 'Udp'))
+    index.add_firewall_rule(
+        firewall_rule('rule-bad', 'Any', 'not-an-ip', 'Any'))
+
+    def names(*args):
+        return sorted(
+            rule.Description for rule in
+            index.overlapping_firewall_rules(*args))
+
+    assert names('Any', '10.0.0.5', 85, 'tcp') == ['rule-one']
+    assert names('Any', '10.0.0.5', 443, 'tcp') == []
+    assert names('Any', '10.0.0.0/16', 'Any') == ['rule-one', 'rule-two']
+    assert names('Any', '10.0.0.0/16', 'Any', 'tcp') == ['rule-one']
+    assert names('192.168.0.2', '10.0.1.5', 'Any') == []
+
+
+def test_overlapping_virtual_servers():
+    config = objectify.Element('EdgeGatewayServiceConfiguration')
+    config.LoadBalancerService = objectify.Element('LoadBalancerService')
+    config.LoadBalancerService.append(virtual_server('vs-one', '10.1.2.3'))
+    config.LoadBalancerService.append(virtual_server('vs-two', '10.1.3.3'))
+
+    index = ConflictIndex(config)
+
+    assert [vs.Name for vs in index.overlapping_virtual_servers(
+        '10.1.2.0/24')] == ['vs-one']
+    assert len(index.overlapping_virtual_servers('10.1.0.0/16')) == 2
+    assert index.overlapping_virtual_servers('10.1.4.3') == []
@@ -5,15 +5,18 @@ import requests
 
 from pyvcd import errors
 from pyvcd.client import VCloudClient
-from pyvcd.network import NetworkDriver
+from pyvcd.network import NetworkDriver, NetworkInventory
 
 
 def networks():
     org_network = objectify.Element('OrgNetworkRecord')
     org_network.attrib['name'] = 'test-org-network'
+    org_network.attrib['href'] = 'test-org-network-href'
+    org_network.attrib['connectedTo'] = 'test-gateway'
 
     external_network = objectify.Element('NetworkRecord')
     external_network.attrib['name'] = 'test-external-network'
+    external_network.attrib['href'] = 'test-external-network-href'
 
     return [
         org_network,
@@ -50,19 +53,55 @@ def test_get_networks():
     mock_external_response.status_code = 200
     mock_external_response.content = external_networks()
 
+    # The queries run concurrently, so respond by url instead of by order.
+    responses = {
+        'query?type=orgNetwork': mock_org_response,
+        'query?type=externalNetwork': mock_external_response,
+    }
     mock_client = mock.create_autospec(VCloudClient)
-    mock_client.request.side_effect = [
-        mock_org_response,
-        mock_external_response,
+    mock_client.url.side_effect = lambda path: path
+    mock_client.request.side_effect = \
+        lambda method, url, data=None, headers=None: responses[url]
+
+    driver = NetworkDriver(mock_client)
+    inventory = driver.get_networks()
+
+    assert inventory
+    assert [network.get('name') for network in inventory] == [
+        'test-org-network',
+        'test-external-network',
     ]
 
+
+def test_get_networks_failure():
+    mock_client = mock.create_autospec(VCloudClient)
+    mock_client.request.side_effect = errors.VCloudAPIError('test-error')
+
     driver = NetworkDriver(mock_client)
-    assert driver.get_networks()
+
+    with nose.tools.assert_raises(errors.VCloudAPIError):
+        driver.get_networks()
+
+
+def test_inventory():
+    inventory = NetworkInventory(networks())
+
+    assert len(inventory) == 2
+    assert inventory.get_by_name('test-external-network').get('href') == \
+        'test-external-network-href'
+    assert inventory.get_by_href('test-org-network-href').get('name') == \
+        'test-org-network'
+    assert [network.get('name') for network in
+            inventory.get_by_gateway('test-gateway')] == ['test-org-network']
+    assert inventory.get_by_gateway('test-other-gateway') == []
+
+    with nose.tools.assert_raises(errors.VCloudNotFoundError):
+        inventory.get_by_href('test-href')
 
 
 @mock.patch('pyvcd.network.NetworkDriver.get_networks', autospec=True)
 def test_get_network_by_name(mock_get_networks):
-    mock_get_networks.return_value = networks()
+    mock_get_networks.return_value = NetworkInventory(networks())
     mock_client = mock.create_autospec(VCloudClient)
 
     driver = NetworkDriver(mock_client)
@@ -74,10 +113,34 @@ def test_get_network_by_name(mock_get_networks):
 
 @mock.patch('pyvcd.network.NetworkDriver.get_networks', autospec=True)
 def test_get_network_by_name_failure(mock_get_networks):
-    mock_get_networks.return_value = []
+    mock_get_networks.return_value = NetworkInventory([])
     mock_client = mock.create_autospec(VCloudClient)
 
     driver = NetworkDriver(mock_client)
 
     with nose.tools.assert_raises(errors.VCloudNotFoundError):
         driver.get_network_by_name('test-network')
+
+
+@mock.patch('pyvcd.network.NetworkDriver.get_networks', autospec=True)
+def test_get_networks_by_names(mock_get_networks):
+    mock_get_networks.return_value = NetworkInventory(networks())
+    mock_client = mock.create_autospec(VCloudClient)
+
+    driver = NetworkDriver(mock_client)
+    names = ['test-external-network', 'test-org-network']
+    found = driver.get_networks_by_names(names)
+
+    assert [network.get('name') for network in found] == names
+    assert mock_get_networks.call_count == 1
+
+
+@mock.patch('pyvcd.network.NetworkDriver.get_networks', autospec=True)
+def test_get_networks_by_names_failure(mock_get_networks):
+    mock_get_networks.return_value = NetworkInventory(networks())
+    mock_client = mock.create_autospec(VCloudClient)
+
+    driver = NetworkDriver(mock_client)
+
+    with nose.tools.assert_raises(errors.VCloudNotFoundError):
+        driver.get_networks_by_names(['test-org-network', 'test-network'])
@@ -0,0 +1,34 @@
+import os
+
+from pyvcd.offload import InProcessBackend, ProcessPoolBackend
+
+
+def pid(content, suffix=''):
+    return '{}{}'.format(os.getpid(), suffix)
+
+
+def test_in_process_backend():
+    backend = InProcessBackend()
+
+    assert backend.apply(pid, 'test-content', '-test') == \
+        '{}-test'.format(os.getpid())
+    backend.close()
+
+
+def test_process_pool_backend():
+    backend = ProcessPoolBackend(processes=1, threshold=10)
+
+    try:
+        # Small documents stay in-process.
+        assert backend.apply(pid, 'small') == str(os.getpid())
+
+        # Large documents go to a worker process.
+        worker_pid = backend.apply(pid, 'x' * 10, '-test')
+        assert worker_pid.endswith('-test')
+        assert worker_pid != '{}-test'.format(os.getpid())
+    finally:
+        backend.close()
+
+    # A closed backend runs everything in-process.
+    assert backend._pool is None
+    assert backend.apply(pid, 'x' * 10) == str(os.getpid())
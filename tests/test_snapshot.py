@@ -0,0 +1,245 @@
+from lxml import etree, objectify
+import mock
+import requests
+
+from pyvcd.client import VCloudClient
+from pyvcd.offload import ProcessPoolBackend
+from pyvcd.snapshot import SnapshotStore, gateway_rows
+
+
+def edge_gateway_records(gateways):
+    mock_records = objectify.Element('QueryResultRecords')
+
+    for name, status in gateways:
+        mock_record = objectify.Element('EdgeGatewayRecord')
+        mock_record.attrib['name'] = name
+        mock_record.attrib['href'] = name + '-href'
+        mock_record.attrib['gatewayStatus'] = status
+        mock_records.append(mock_record)
+
+    return etree.tostring(mock_records)
+
+
+def edge_gateway(vip):
+    rule = objectify.Element('FirewallRule')
+    rule.IsEnabled = 'true'
+    rule.Description = 'test-rule'
+    rule.Policy = 'allow'
+    rule.Protocols = objectify.Element('Protocols')
+    rule.Protocols.Tcp = 'true'
+    rule.Port = 443
+    rule.DestinationPortRange = 443
+    rule.DestinationIp = vip
+    rule.SourcePort = -1
+    rule.SourcePortRange = 'Any'
+    rule.SourceIp = 'Any'
+
+    firewall_service = objectify.Element('FirewallService')
+    firewall_service.append(rule)
+
+    member = objectify.Element('Member')
+    member.IpAddress = '192.168.0.10'
+    member.Weight = 1
+    member.ServicePort = objectify.Element('ServicePort')
+    member.ServicePort.Port = 8443
+
+    pool = objectify.Element('Pool')
+    pool.Name = 'test-pool'
+    pool.Description = 'test-description'
+    pool.append(member)
+
+    virtual_server = objectify.Element('VirtualServer')
+    virtual_server.Name = 'test-vs'
+    virtual_server.Interface = objectify.Element(
+        'Interface', name='test-network')
+    virtual_server.IpAddress = vip
+    virtual_server.Pool = 'test-pool'
+
+    load_balancer_service = objectify.Element('LoadBalancerService')
+    load_balancer_service.append(pool)
+    load_balancer_service.append(virtual_server)
+
+    service_config = objectify.Element('EdgeGatewayServiceConfiguration')
+    service_config.append(firewall_service)
+    service_config.append(load_balancer_service)
+
+    config = objectify.Element('Configuration')
+    config.append(service_config)
+
+    mock_edge_gateway = objectify.Element('EdgeGateway')
+    mock_edge_gateway.append(config)
+
+    return etree.tostring(mock_edge_gateway)
+
+
+def networks(record_type):
+    record = objectify.Element(record_type)
+    record.attrib['name'] = 'test-' + record_type
+    record.attrib['connectedTo'] = 'gw-one'
+
+    results = objectify.Element('QueryResultRecords')
+    results.append(record)
+    return etree.tostring(results)
+
+
+def get_mock_client(gateways, documents):
+    def request(method, url, data=None, headers=None):
+        mock_response = mock.create_autospec(requests.Response)
+        mock_response.status_code = 200
+        if url.endswith('type=edgeGateway'):
+            mock_response.content = edge_gateway_records(gateways)
+        elif url.endswith('type=orgNetwork'):
+            mock_response.content = networks('OrgNetworkRecord')
+        elif url.endswith('type=externalNetwork'):
+            mock_response.content = networks('NetworkRecord')
+        else:
+            mock_response.content = documents[url]
+        return mock_response
+
+    mock_client = mock.create_autospec(VCloudClient)
+    mock_client.url.side_effect = lambda path: 'https://test/api/' + path
+    mock_client.request.side_effect = request
+
+    return mock_client
+
+
+def fetched(mock_client):
+    return sorted(
+        call[0][1] for call in mock_client.request.call_args_list
+        if call[0][1].endswith('-href'))
+
+
+def test_gateway_rows():
+    rows = gateway_rows(edge_gateway('10.1.2.3'))
+
+    assert rows['firewall_rules'] == [(
+        'test-rule', 'allow', 'tcp', 'Any', 'Any', '10.1.2.3', '443',
+        443, 443, 1)]
+    assert rows['pools'] == [('test-pool', 'test-description')]
+    assert rows['pool_members'] == [('test-pool', '192.168.0.10', '8443', '1')]
+    assert rows['virtual_servers'] == [
+        ('test-vs', '10.1.2.3', 'test-pool', 'test-network')]
+
+
+def test_refresh():
+    documents = {
+        'gw-one-href': edge_gateway('10.1.2.3'),
+        'gw-two-href': edge_gateway('10.1.2.4'),
+    }
+    mock_client = get_mock_client(
+        [('gw-one', 'READY'), ('gw-two', 'READY')], documents)
+
+    store = SnapshotStore(mock_client, workers=2)
+    assert sorted(store.refresh()) == ['gw-one', 'gw-two']
+    assert store.gateways() == ['gw-one', 'gw-two']
+    assert fetched(mock_client) == ['gw-one-href', 'gw-two-href']
+
+    assert store.gateways_with_vip('10.1.2.3') == ['gw-one']
+    assert len(store.rules_allowing_port(443)) == 2
+    assert not store.rules_allowing_port(80)
+    assert len(store.firewall_rules(gateway='gw-two')) == 1
+    assert len(store.pools(name='test-pool')) == 2
+    assert len(store.pool_members(ip_address='192.168.0.10')) == 2
+    assert store.virtual_servers(gateway='gw-two')[0]['ip_address'] == \
+        '10.1.2.4'
+    assert len(store.networks(gateway='gw-one')) == 2
+    assert store.networks(name='test-NetworkRecord')[0]['type'] == \
+        'NetworkRecord'
+
+
+def test_rules_allowing_port():
+    edge_gateway_element = objectify.fromstring(edge_gateway('10.1.2.3'))
+    firewall_service = edge_gateway_element.Configuration \
+        .EdgeGatewayServiceConfiguration.FirewallService
+    for description, enabled, protocol in [
+            ('test-disabled', 'false', 'Tcp'),
+            ('test-icmp', 'true', 'Icmp'),
+            ('test-udp', 'true', 'Udp'),
+            ('test-any', 'true', 'Any')]:
+        rule = objectify.Element('FirewallRule')
+        rule.IsEnabled = enabled
+        rule.Description = description
+        rule.Policy = 'allow'
+        rule.Protocols = objectify.Element('Protocols')
+        rule.Protocols[protocol] = 'true'
+        rule.DestinationPortRange = 'Any'
+        firewall_service.append(rule)
+
+    mock_client = get_mock_client(
+        [('gw-one', 'READY')],
+        {'gw-one-href': etree.tostring(edge_gateway_element)})
+    store = SnapshotStore(mock_client)
+    store.refresh()
+
+    # Disabled and ICMP rules don't allow the port.
+    assert sorted(
+        rule['description'] for rule in store.rules_allowing_port(443)) == [
+        'test-any', 'test-rule', 'test-udp']
+    assert len(store.firewall_rules(port=443)) == 4
+    assert [rule['description']
+            for rule in store.firewall_rules(enabled=False)] == [
+        'test-disabled']
+
+
+def test_refresh_incremental():
+    documents = {
+        'gw-one-href': edge_gateway('10.1.2.3'),
+        'gw-two-href': edge_gateway('10.1.2.4'),
+    }
+    gateways = [('gw-one', 'READY'), ('gw-two', 'READY')]
+    mock_client = get_mock_client(gateways, documents)
+
+    store = SnapshotStore(mock_client)
+    store.refresh()
+
+    # Nothing changed, nothing is fetched.
+    mock_client.request.reset_mock()
+    assert store.refresh() == []
+    assert fetched(mock_client) == []
+
+    # Only the changed gateway is fetched.
+    gateways[1] = ('gw-two', 'BUSY')
+    documents['gw-two-href'] = edge_gateway('10.1.2.5')
+    mock_client.request.reset_mock()
+    assert store.refresh() == ['gw-two']
+    assert fetched(mock_client) == ['gw-two-href']
+    assert store.gateways_with_vip('10.1.2.5') == ['gw-two']
+    assert store.gateways_with_vip('10.1.2.4') == []
+
+    # Removed gateways are dropped from the snapshot.
+    del gateways[0]
+    store.refresh()
+    assert store.gateways() == ['gw-two']
+    assert store.firewall_rules(gateway='gw-one') == []
+
+
+def test_refresh_full():
+    documents = {
+        'gw-one-href': edge_gateway('10.1.2.3'),
+    }
+    mock_client = get_mock_client([('gw-one', 'READY')], documents)
+
+    store = SnapshotStore(mock_client)
+    store.refresh()
+
+    # Unchanged documents are fetched but not rewritten.
+    mock_client.request.reset_mock()
+    assert store.refresh(full=True) == []
+    assert fetched(mock_client) == ['gw-one-href']
+
+
+def test_refresh_process_pool_backend():
+    documents = {
+        'gw-one-href': edge_gateway('10.1.2.3'),
+        'gw-two-href': edge_gateway('10.1.2.4'),
+    }
+    mock_client = get_mock_client(
+        [('gw-one', 'READY'), ('gw-two', 'READY')], documents)
+    backend = ProcessPoolBackend(processes=2, threshold=0)
+
+    try:
+        store = SnapshotStore(mock_client, backend=backend)
+        assert sorted(store.refresh()) == ['gw-one', 'gw-two']
+        assert store.gateways_with_vip('10.1.2.4') == ['gw-two']
+    finally:
+        backend.close()
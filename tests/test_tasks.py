@@ -0,0 +1,138 @@
+import threading
+
+from pyvcd.tasks import (
+    LocalBroker, NotificationTaskSource, parse_notification, task_id)
+
+
+TASK_URL = 'https://test-host/api/task/test-task-id'
+
+
+def notification(
+        event='complete', task='test-task-id', operation_success='true'):
+    return (
+        '<vmext:Notification '
+        'xmlns:vmext="http://www.vmware.com/vcloud/extension/v1.5" '
+        'type="com/vmware/vcloud/event/task/{}" '
+        'operationSuccess="{}">'
+        '<vmext:Link rel="up" href="https://test-host/api/org/test-org"/>'
+        '<vmext:Link rel="entity" '
+        'href="https://test-host/api/task/{}" '
+        'type="application/vnd.vmware.vcloud.task+xml"/>'
+        '</vmext:Notification>'
+    ).format(event, operation_success, task)
+
+
+def get_source(deadline=5):
+    source = NotificationTaskSource(deadline)
+    broker = LocalBroker()
+    broker.basic_consume(source.on_message)
+    return source, broker
+
+
+def test_task_id():
+    assert task_id(TASK_URL) == 'test-task-id'
+    assert task_id('urn:vcloud:task:test-task-id') == 'test-task-id'
+
+
+def test_parse_notification():
+    assert parse_notification(notification()) == ('test-task-id', 'success')
+    assert parse_notification(notification('fail')) == \
+        ('test-task-id', 'error')
+    assert parse_notification(notification('abort')) == \
+        ('test-task-id', 'aborted')
+    assert parse_notification(
+        notification(operation_success='false')) == ('test-task-id', 'error')
+    assert parse_notification(notification('start')) is None
+
+
+def test_wait():
+    source, broker = get_source()
+
+    timer = threading.Timer(
+        0.05, broker.basic_publish, args=(notification(),))
+    timer.start()
+
+    assert source.wait(TASK_URL) == 'success'
+    timer.join()
+
+
+def test_wait_event_before_wait():
+    source, broker = get_source()
+
+    broker.basic_publish(notification('fail'))
+    broker.basic_publish('not xml')
+    broker.basic_publish(notification('start', 'test-other-task-id'))
+
+    assert source.wait(TASK_URL) == 'error'
+
+
+def test_wait_many():
+    source, broker = get_source()
+    results = {}
+
+    def wait(task):
+        results[task] = source.wait('https://test-host/api/task/' + task)
+
+    tasks = ['test-task-{}'.format(index) for index in xrange(50)]
+    threads = [threading.Thread(target=wait, args=(task,)) for task in tasks]
+    for thread in threads:
+        thread.start()
+    for task in tasks:
+        broker.basic_publish(notification(task=task))
+    for thread in threads:
+        thread.join()
+
+    assert results == dict((task, 'success') for task in tasks)
+
+
+def test_wait_deadline():
+    source, broker = get_source(deadline=0.01)
+
+    broker.basic_publish(notification(task='test-other-task-id'))
+
+    assert source.wait(TASK_URL) is None
+    assert not source._waiters
+
+
+def test_history():
+    source = NotificationTaskSource(deadline=0, history=2)
+    broker = LocalBroker()
+    broker.basic_consume(source.on_message)
+
+    for index in xrange(3):
+        broker.basic_publish(notification(task='test-task-{}'.format(index)))
+
+    assert source.wait('test-task-0') is None
+    assert source.wait('test-task-2') == 'success'
+
+
+def test_local_broker():
+    broker = LocalBroker()
+    deliveries = []
+    broker.basic_consume(
+        lambda channel, method, properties, body:
+        deliveries.append((method, body)))
+
+    broker.basic_publish('test-one', 'test-key')
+    broker.basic_publish('test-two')
+
+    assert [method.delivery_tag for method, _ in deliveries] == [1, 2]
+    assert deliveries[0][0].routing_key == 'test-key'
+    assert deliveries[1][1] == 'test-two'
+
+    broker.basic_ack(1)
+    assert broker.acked == [1]
+    broker.basic_ack(2, multiple=True)
+    assert broker.acked == [1, 2]
+
+
+def test_on_message_ack():
+    source, broker = get_source()
+
+    broker.basic_publish(notification())
+    broker.basic_publish(notification(event='start'))
+    broker.basic_publish('not xml')
+
+    # Handled, ignored and unparseable messages are all acknowledged.
+    assert broker.acked == [1, 2, 3]
+    assert source.wait(TASK_URL) == 'success'
@@ -0,0 +1,158 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from lxml import etree, objectify
+import mock
+import nose.tools
+import requests
+
+from pyvcd import errors
+from pyvcd.client import VCloudClient
+from pyvcd.edge_gateway import EdgeGatewayDriver
+from pyvcd.transport import (
+    RecordingTransport, ReplayTransport, RequestsTransport)
+
+
+HOST = 'test-host'
+VERSION = '5.1'
+ORG = 'test-org'
+
+
+def response(content='', status_code=200, headers=None):
+    mock_response = mock.create_autospec(requests.Response)
+    mock_response.status_code = status_code
+    mock_response.headers = headers or {}
+    mock_response.content = content
+    return mock_response
+
+
+def responses():
+    record = objectify.Element('EdgeGatewayRecord')
+    record.attrib['name'] = 'test-name'
+    record.attrib['href'] = 'https://test-host/api/admin/edgeGateway/test'
+    records = objectify.Element('QueryResultRecords')
+    records.append(record)
+
+    config = objectify.Element('Configuration')
+    config.append(objectify.Element('EdgeGatewayServiceConfiguration'))
+    edge_gateway = objectify.Element('EdgeGateway')
+    edge_gateway.attrib['href'] = record.get('href')
+    edge_gateway.append(config)
+
+    task = objectify.Element('Task')
+    task.attrib['href'] = 'https://test-host/api/task/test-task'
+    task.attrib['status'] = 'success'
+
+    return [
+        response(headers={'x-vcloud-authorization': 'test-token'}),
+        response(etree.tostring(records)),
+        response(etree.tostring(edge_gateway)),
+        response(etree.tostring(task)),
+        response(etree.tostring(task)),
+    ]
+
+
+def run_flow(client):
+    client.authenticate('test-user', 'test-pass')
+    driver = EdgeGatewayDriver(client, 'test-name')
+    driver.load()
+    driver.add_firewall_rule('test-rule-one', 'TCP', 'any', 80, 'any')
+    driver.commit(stream=True)
+
+
+class TestTransport(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'session.jsonl')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self):
+        mock_transport = mock.create_autospec(RequestsTransport)
+        mock_transport.request.side_effect = responses()
+
+        client = VCloudClient(
+            HOST, VERSION, ORG, RecordingTransport(self.path, mock_transport))
+        run_flow(client)
+
+        return mock_transport
+
+    def test_record(self):
+        mock_transport = self.record()
+
+        with open(self.path) as stream:
+            exchanges = [json.loads(line) for line in stream]
+
+        assert len(exchanges) == mock_transport.request.call_count == 5
+        assert [exchange['method'] for exchange in exchanges] == [
+            'POST', 'GET', 'GET', 'POST', 'GET']
+        assert exchanges[0]['headers']['x-vcloud-authorization'] == \
+            'redacted'
+        assert exchanges[3]['body']
+        assert exchanges[3]['elapsed'] >= 0
+
+    def test_replay(self):
+        self.record()
+
+        transport = ReplayTransport(self.path)
+        client = VCloudClient(HOST, VERSION, ORG, transport)
+        run_flow(client)
+
+        assert client.auth_token == 'redacted'
+        assert transport.remaining() == 0
+
+        with nose.tools.assert_raises(errors.VCloudNotFoundError):
+            transport.request('GET', 'https://test-host/api/task/test-task')
+
+    def test_replay_latency(self):
+        self.record()
+
+        with open(self.path) as stream:
+            exchanges = [json.loads(line) for line in stream]
+        for exchange in exchanges:
+            exchange['elapsed'] = 0.02
+        with open(self.path, 'w') as stream:
+            for exchange in exchanges:
+                stream.write(json.dumps(exchange) + '\n')
+
+        client = VCloudClient(HOST, VERSION, ORG, ReplayTransport(
+            self.path, latency=True))
+        started = time.time()
+        run_flow(client)
+
+        assert time.time() - started >= 0.1
+
+
+@mock.patch('requests.Session.request', autospec=True)
+def test_requests_transport(mock_request):
+    mock_request.return_value = response()
+
+    transport = RequestsTransport()
+    assert transport.request('GET', 'test-url', data='test-data')
+    mock_request.assert_called_once_with(
+        mock.ANY, 'GET', 'test-url', data='test-data')
+
+
+def test_requests_transport_session_per_thread():
+    transport = RequestsTransport()
+    sessions = []
+
+    def work():
+        sessions.append(transport.session())
+        sessions.append(transport.session())
+
+    threads = [threading.Thread(target=work) for _ in xrange(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # One session per thread, reused within the thread.
+    assert len(set(sessions)) == 4
+    assert transport.session() not in sessions
+    assert transport.session() is transport.session()
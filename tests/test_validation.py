@@ -0,0 +1,170 @@
+from lxml import objectify
+
+from pyvcd.validation import Validator
+
+
+def firewall_rule(
+        name='test-rule', protocol='Tcp', policy='allow',
+        dest_port_range='80', dest_ip='10.0.0.1', src_ip='Any'):
+    rule = objectify.Element('FirewallRule')
+    rule.IsEnabled = 'true'
+    rule.Description = name
+    rule.Policy = policy
+    rule.Protocols = objectify.Element('Protocols')
+    rule.Protocols[protocol] = 'true'
+    rule.Port = dest_port_range
+    rule.DestinationPortRange = dest_port_range
+    rule.DestinationIp = dest_ip
+    rule.SourcePort = -1
+    rule.SourcePortRange = 'Any'
+    rule.SourceIp = src_ip
+    return rule
+
+
+def service_port(protocol='HTTP', port='80', algorithm='ROUND_ROBIN'):
+    element = objectify.Element('ServicePort')
+    element.IsEnabled = 'true'
+    element.Protocol = protocol
+    element.Algorithm = algorithm
+    element.Port = port
+    element.HealthCheckPort = port
+    return element
+
+
+def pool(name='test-pool', member_ip='10.0.0.10', weight='1', **kwargs):
+    member = objectify.Element('Member')
+    member.IpAddress = member_ip
+    member.Weight = weight
+
+    element = objectify.Element('Pool')
+    element.Name = name
+    element.append(service_port(**kwargs))
+    element.append(member)
+    return element
+
+
+def virtual_server(ip_address='10.0.0.1', pool_name='test-pool', port='80'):
+    service_profile = objectify.Element('ServiceProfile')
+    service_profile.IsEnabled = 'true'
+    service_profile.Protocol = 'HTTP'
+    service_profile.Port = port
+
+    element = objectify.Element('VirtualServer')
+    element.Name = 'test-vs'
+    element.IpAddress = ip_address
+    element.append(service_profile)
+    element.Pool = pool_name
+    return element
+
+
+def test_validate():
+    validator = Validator(['test-pool'])
+    for element in [
+            firewall_rule(),
+            firewall_rule(
+                policy='Deny', protocol='Any', dest_port_range='8000-8080',
+                dest_ip='10.0.0.0/24', src_ip='192.168.0.1-192.168.0.9'),
+            pool(),
+            virtual_server()]:
+        validator.validate(element)
+
+    assert validator.errors == []
+
+
+def test_validate_errors():
+    validator = Validator(['test-pool'])
+    for element in [
+            firewall_rule(
+                'rule-one', protocol='Foo', policy='maybe',
+                dest_port_range='70000', dest_ip='10.0.0'),
+            pool(member_ip='10.0.0.300', weight='500', protocol='FTP',
+                 algorithm='RANDOM', port='Any'),
+            virtual_server(ip_address='10.0.0.0/24', pool_name='test-other',
+                           port='8O')]:
+        validator.validate(element)
+
+    # Every error is reported in one pass.
+    assert len(validator.errors) == 14
+    assert "Firewall rule 'rule-one': DestinationIp '10.0.0' is invalid." in \
+        validator.errors
+    assert "Virtual server 'test-vs': Pool 'test-other' does not exist." in \
+        validator.errors
+
+
+def test_validate_parse_once():
+    validator = Validator()
+    for index in xrange(100):
+        validator.validate(firewall_rule('rule-{}'.format(index)))
+
+    assert validator.errors == []
+    assert len(validator._parsed) == 5
+
+
+VCD_POOL = '''
+<Pool xmlns="http://www.vmware.com/vcloud/v1.5">
+    <Name>web-pool</Name>
+    <ServicePort>
+        <IsEnabled>true</IsEnabled>
+        <Protocol>HTTP</Protocol>
+        <Algorithm>ROUND_ROBIN</Algorithm>
+        <Port>80</Port>
+        <HealthCheckPort/>
+        <HealthCheck>
+            <Mode>HTTP</Mode>
+            <Uri>/</Uri>
+        </HealthCheck>
+    </ServicePort>
+    <ServicePort>
+        <IsEnabled>false</IsEnabled>
+        <Protocol>HTTPS</Protocol>
+        <Algorithm>ROUND_ROBIN</Algorithm>
+        <Port>443</Port>
+        <HealthCheckPort/>
+    </ServicePort>
+    <ServicePort>
+        <IsEnabled>false</IsEnabled>
+        <Protocol>TCP</Protocol>
+        <Algorithm>ROUND_ROBIN</Algorithm>
+        <Port/>
+        <HealthCheckPort/>
+    </ServicePort>
+    <Member>
+        <IpAddress>10.0.0.10</IpAddress>
+        <Weight>1</Weight>
+        <ServicePort>
+            <Protocol>HTTP</Protocol>
+            <Port>80</Port>
+            <HealthCheckPort/>
+        </ServicePort>
+        <ServicePort>
+            <Protocol>HTTPS</Protocol>
+            <Port>443</Port>
+            <HealthCheckPort/>
+        </ServicePort>
+        <ServicePort>
+            <Protocol>TCP</Protocol>
+            <Port/>
+            <HealthCheckPort/>
+        </ServicePort>
+    </Member>
+</Pool>
+'''
+
+
+def test_validate_disabled_service_ports():
+    element = objectify.fromstring(VCD_POOL)
+
+    validator = Validator()
+    validator.validate(element)
+    validator.validate(element.Member)
+    assert validator.errors == []
+
+    # Enabled service ports still need a Port.
+    element.ServicePort[0].Port = ''
+    element.Member.ServicePort[0].Port = ''
+    validator = Validator()
+    validator.validate(element)
+    assert validator.errors == [
+        "Pool 'web-pool': Port '' is invalid.",
+        "Pool 'web-pool' member '10.0.0.10': Port '' is invalid.",
+    ]